@@ -1,10 +1,47 @@
 #!/usr/bin/env python3
 """
 aruco_tracker.py – Real-time ArUco marker tracking.
+
+Single source (default): one camera or video, shown in a window.
+Multi source (--sources 0 1 cam2.mp4 ...): all sources are ingested
+concurrently and detection results are written to stdout as one
+time-ordered JSON-lines stream.
+
+--traj PATH records every detection to a trajectory file (one file per
+source in multi-source mode: run.traj -> run.src0.traj, run.src1.traj, ...).
+
+--kalman keeps a constant-velocity Kalman filter per marker id, so markers
+coast through short occlusions (--max-coast frames). --detect-every N runs
+detection on every N-th frame only and predicts corners in between (implies
+--kalman). Predicted markers are drawn in yellow and flagged in all outputs.
+
+--motion-gate (single source) reuses the previous detection while the
+frame is unchanged, e.g. a fixed camera watching a still scene.
+
+--params-profile PATH loads tuned DetectorParameters (see aruco_tune.py):
+the fastest saved set whose recall is at least --min-recall.
+
+--target-fps F (single source) lowers the detection rate and resolution
+while frames take longer than 1/F s, and restores them when there is
+headroom again (see quality_controller.py). --quality-log PATH records the
+settings of every frame.
 """
 
 import cv2
 import argparse
+import numpy as np
+import json
+import os
+import sys
+import threading
+import time
+
+from video_io import VideoSource
+from multi_source import MultiSourceScheduler, parse_source
+from trajectory_store import TrajectoryWriter
+from marker_filter import MarkerEstimate, MarkerFilterBank
+from motion_gate import MotionGate
+from quality_controller import ARUCO_LEVELS, QualityController, QualityLog
 
 
 def parse_args():
@@ -13,65 +50,335 @@ def parse_args():
                         help="Path to video file. If not provided, webcam is used.")
     parser.add_argument("--camera", type=int, default=0,
                         help="Camera index to use if no video is provided.")
+    parser.add_argument("--sources", nargs="+", default=None,
+                        help="Multi-source mode: camera indices and/or video paths.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4,
+                        help="Detection worker threads in multi-source mode.")
+    parser.add_argument("--traj", default=None,
+                        help="Optional .traj file to record marker trajectories.")
+    parser.add_argument("--kalman", action="store_true",
+                        help="Filter marker corners and bridge short occlusions.")
+    parser.add_argument("--detect-every", type=int, default=1,
+                        help="Run detection on every N-th frame, predict in between.")
+    parser.add_argument("--max-coast", type=int, default=15,
+                        help="Frames a marker may be predicted without a detection.")
+    parser.add_argument("--motion-gate", action="store_true",
+                        help="Reuse the last detection while the frame is unchanged (single source).")
+    parser.add_argument("--params-profile", default=None,
+                        help="DetectorParameters profile written by aruco_tune.py.")
+    parser.add_argument("--min-recall", type=float, default=0.99,
+                        help="Use the fastest profile entry with at least this recall.")
+    parser.add_argument("--target-fps", type=float, default=None,
+                        help="Lower detection rate / resolution to hold this frame rate.")
+    parser.add_argument("--quality-log", default=None,
+                        help="CSV of per-frame latency and quality settings (--target-fps).")
     return parser.parse_args()
 
 
-def ensure_upright(frame):
-    h, w = frame.shape[:2]
-    if h > w:
-        frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
-    return frame
+def make_detector(params=None):
+    """params: DetectorParameters attribute overrides, e.g. from a tuned profile."""
+    aruco_dict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
+    detector_params = cv2.aruco.DetectorParameters()
+    for name, value in (params or {}).items():
+        setattr(detector_params, name, value)
+    return cv2.aruco.ArucoDetector(aruco_dict, detector_params)
+
+
+def load_params_profile(path, min_recall=0.99):
+    """
+    Pick DetectorParameters overrides from an aruco_tune.py profile: the
+    fastest Pareto entry with recall >= min_recall, else the best recall.
+    Returns the entry (params, recall, ms_per_frame).
+    """
+    with open(path) as f:
+        pareto = json.load(f)["pareto"]
+    if not pareto:
+        raise ValueError(f"{path}: empty profile")
+    ok = [e for e in pareto if e["recall"] >= min_recall]
+    if ok:
+        return min(ok, key=lambda e: e["ms_per_frame"])
+    return max(pareto, key=lambda e: e["recall"])
+
+
+def make_filter_bank(args):
+    adaptive = args.target_fps and not args.sources
+    if not (args.kalman or args.detect_every > 1 or adaptive):
+        return None
+    if adaptive and not args.kalman:
+        # only bridge frames whose detection was skipped: a marker missed by
+        # a detection is not coasted (main() follows detect_every changes)
+        return MarkerFilterBank(max_coast=args.detect_every - 1)
+    detect_every = args.detect_every
+    if adaptive:
+        detect_every = max(detect_every, max(q.detect_every for q in ARUCO_LEVELS))
+    return MarkerFilterBank(max_coast=max(args.max_coast, detect_every))
+
+
+def detect_scaled(detector, gray, scale, small=None):
+    """
+    detectMarkers on gray downscaled by scale (into small when given),
+    corners mapped back to full resolution.
+    """
+    if scale == 1.0:
+        corners, ids, _ = detector.detectMarkers(gray)
+        return corners, ids
+    h, w = gray.shape[:2]
+    size = (max(1, int(w * scale)), max(1, int(h * scale)))
+    small = cv2.resize(gray, size, dst=small, interpolation=cv2.INTER_AREA)
+    corners, ids, _ = detector.detectMarkers(small)
+    return tuple(c / scale for c in corners), ids
+
+
+def estimate_markers(bank, frame_idx, corners, ids, detected):
+    """Detections -> MarkerEstimate list, through the Kalman bank if enabled."""
+    if bank is not None:
+        return bank.step(frame_idx, corners, ids, detected)
+    if ids is None:
+        return []
+    return [MarkerEstimate(int(marker_id), pts, True, 0.0)
+            for pts, marker_id in zip(corners, ids)]
+
+
+def upright_estimates(src, estimates):
+    return [m._replace(corners=src.to_upright_points(m.corners)) for m in estimates]
+
+
+def draw_markers(frame, estimates):
+    measured = [m for m in estimates if m.measured]
+    if measured:
+        cv2.aruco.drawDetectedMarkers(
+            frame, [m.corners for m in measured],
+            np.array([[m.id] for m in measured], dtype=np.int32)
+        )
+
+    # Draw center points and ID text
+    for m in estimates:
+        pts = m.corners.reshape(-1, 2)
+        cx = int(pts[:, 0].mean())
+        cy = int(pts[:, 1].mean())
+        label = f"ID {m.id}"
+        color = (0, 255, 0)
+        if not m.measured:
+            cv2.polylines(frame, [pts.astype(np.int32)], True, (0, 255, 255), 2)
+            label += f" pred +/-{m.sigma:.0f}px"
+            color = (0, 255, 255)
+        cv2.circle(frame, (cx, cy), 6, (0, 0, 255), -1)
+        cv2.putText(frame, label,
+                    (cx - 10, cy - 20),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6,
+                    color, 2)
+
+
+def record_markers(traj, frame_idx, timestamp, estimates):
+    """
+    Append one row per marker (corners in upright coordinates).
+    Measured rows get confidence 1, predicted rows 1 / (1 + sigma).
+    """
+    for m in estimates:
+        pts = m.corners.reshape(-1, 2)
+        box = (pts[:, 0].min(), pts[:, 1].min(), pts[:, 0].max(), pts[:, 1].max())
+        center = (pts[:, 0].mean(), pts[:, 1].mean())
+        confidence = 1.0 if m.measured else 1.0 / (1.0 + m.sigma)
+        traj.append(frame_idx, timestamp, m.id, box, center, confidence=confidence)
+
+
+def profile_params(args, out=sys.stdout):
+    if not args.params_profile:
+        return None
+    entry = load_params_profile(args.params_profile, args.min_recall)
+    print(f"[INFO] Detector profile {args.params_profile}: recall {entry['recall']:.3f}, "
+          f"{entry['ms_per_frame']:.2f} ms/frame, {entry['params']}", file=out)
+    return entry["params"]
+
+
+def run_multi(args, params=None):
+    sources = [parse_source(s) for s in args.sources]
+    if args.target_fps:
+        print("[WARN] --target-fps is ignored in multi-source mode.", file=sys.stderr)
+    if args.motion_gate:
+        print("[WARN] --motion-gate is ignored in multi-source mode.", file=sys.stderr)
+    local = threading.local()  # one detector per worker thread
+
+    def process(frame):
+        if frame.frame_idx % args.detect_every != 0:
+            return (), None, False
+        detector = getattr(local, "detector", None)
+        if detector is None:
+            detector = local.detector = make_detector(params)
+        corners, ids, _ = detector.detectMarkers(frame.gray)
+        return corners, ids, True
+
+    try:
+        sched = MultiSourceScheduler(sources, process, workers=args.workers)
+    except IOError as e:
+        print(f"[ERROR] {e}", file=sys.stderr)
+        return
+
+    # filters run in the consumer, which sees each source in frame order
+    banks = [make_filter_bank(args) for _ in sched.sources]
+
+    trajs = []
+    if args.traj:
+        stem = args.traj[:-5] if args.traj.endswith(".traj") else args.traj
+        for i, (s, src) in enumerate(zip(args.sources, sched.sources)):
+            trajs.append(TrajectoryWriter(f"{stem}.src{i}.traj", meta={
+                "tracker": "aruco", "source": s, "fps": src.fps,
+                "width": src.width, "height": src.height,
+            }))
+
+    print(f"[INFO] Tracking ArUco markers on {len(sources)} sources "
+          f"with {args.workers} workers.", file=sys.stderr)
+
+    t0 = None
+    for r in sched.results():
+        if t0 is None:
+            t0 = r.timestamp
+        corners, ids, detected = r.result
+        src = sched.sources[r.source]
+        estimates = estimate_markers(banks[r.source], r.frame_idx,
+                                     corners, ids, detected)
+        estimates = upright_estimates(src, estimates)
+        if trajs:
+            record_markers(trajs[r.source], r.frame_idx, r.timestamp - t0, estimates)
+        markers = []
+        for m in estimates:
+            pts = m.corners.reshape(-1, 2)
+            markers.append({
+                "id": m.id,
+                "center": [float(pts[:, 0].mean()), float(pts[:, 1].mean())],
+                "predicted": not m.measured,
+                "sigma": round(m.sigma, 3),
+            })
+        print(json.dumps({
+            "t": round(r.timestamp - t0, 6),
+            "source": args.sources[r.source],
+            "frame": r.frame_idx,
+            "markers": markers,
+        }), flush=True)
+
+    for traj in trajs:
+        traj.close()
+
+    for s, cap, drop, done in zip(args.sources, sched.captured,
+                                  sched.dropped, sched.processed):
+        print(f"[INFO] {s}: captured={cap} dropped={drop} processed={done}",
+              file=sys.stderr)
 
 
 def main():
     args = parse_args()
 
+    try:
+        params = profile_params(args, out=sys.stderr if args.sources else sys.stdout)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"[ERROR] Cannot load detector profile: {e}")
+        return
+
+    if args.sources:
+        run_multi(args, params)
+        return
+
     if args.video:
         print(f"[INFO] Opening video: {args.video}")
-        cap = cv2.VideoCapture(args.video)
+        cap = VideoSource(args.video)
     else:
-        cap = cv2.VideoCapture(args.camera)
+        cap = VideoSource(args.camera)
 
     if not cap.isOpened():
         print("[ERROR] Could not open video source.")
         return
 
     # Load ArUco dictionary
-    aruco_dict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
-    params = cv2.aruco.DetectorParameters()
-    detector = cv2.aruco.ArucoDetector(aruco_dict, params)
+    detector = make_detector(params)
+    bank = make_filter_bank(args)
+    gate = MotionGate() if args.motion_gate else None
+    last_detection = None
+
+    traj = None
+    if args.traj:
+        traj = TrajectoryWriter(args.traj, meta={
+            "tracker": "aruco", "source": args.video or args.camera,
+            "fps": cap.fps, "width": cap.width, "height": cap.height,
+        })
 
     print("[INFO] Tracking ArUco markers... Press 'q' to quit.")
 
+    quality = qlog = None
+    if args.target_fps:
+        quality = QualityController(ARUCO_LEVELS, args.target_fps)
+        if args.quality_log:
+            qlog = QualityLog(args.quality_log)
+    detect_every, scale, small = args.detect_every, 1.0, None
+
+    frame_idx = -1
+    next_detect = 0
+    t_last = time.perf_counter()
     while True:
-        ret, frame = cap.read()
+        ret, frame, gray = cap.read()
         if not ret:
             break
+        frame_idx += 1
 
-        frame = ensure_upright(frame)
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        # Detect markers on the native-orientation gray frame
+        detected = frame_idx >= next_detect
+        corners, ids = (), None
+        if detected:
+            next_detect = frame_idx + detect_every
+            static = gate is not None and gate.is_static(gray)
+            if static and last_detection is not None:
+                corners, ids = last_detection
+            else:
+                corners, ids = detect_scaled(detector, gray, scale, small)
+                last_detection = (corners, ids)
 
-        # Detect markers
-        corners, ids, rejected = detector.detectMarkers(gray)
+        estimates = estimate_markers(bank, frame_idx, corners, ids, detected)
+        estimates = upright_estimates(cap, estimates)
 
-        if ids is not None:
-            cv2.aruco.drawDetectedMarkers(frame, corners, ids)
+        frame = cap.upright(frame)
+        draw_markers(frame, estimates)
 
-            # Draw center points and ID text
-            for pts, marker_id in zip(corners, ids):
-                pts = pts[0]
-                cx = int(pts[:, 0].mean())
-                cy = int(pts[:, 1].mean())
-                cv2.circle(frame, (cx, cy), 6, (0, 0, 255), -1)
-                cv2.putText(frame, f"ID {int(marker_id)}",
-                            (cx - 10, cy - 20),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6,
-                            (0, 255, 0), 2)
+        if traj is not None:
+            record_markers(traj, frame_idx, cap.frame_time(frame_idx), estimates)
 
         cv2.imshow("ArUco Marker Tracker", frame)
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
 
+        if quality is not None:
+            now = time.perf_counter()
+            latency, t_last = now - t_last, now
+            if qlog is not None:
+                qlog.write(frame_idx, latency, quality)
+            if quality.update(latency):
+                q = quality.settings
+                detect_every = max(args.detect_every, q.detect_every)
+                next_detect = min(next_detect, frame_idx + detect_every)
+                if not args.kalman:
+                    bank.max_coast = detect_every - 1
+                if q.scale != scale:
+                    scale = q.scale
+                    h, w = gray.shape[:2]
+                    small = np.empty((max(1, int(h * scale)), max(1, int(w * scale))),
+                                     dtype=np.uint8) if scale != 1.0 else None
+                print(f"[INFO] Frame {frame_idx}: quality level {quality.level} {q}")
+
+    if traj is not None:
+        traj.close()
+        print(f"[INFO] Trajectory saved to {args.traj}")
+
+    if gate is not None:
+        print(f"[INFO] Motion gate: {gate.summary()}")
+
+    if bank is not None:
+        print(f"[INFO] Marker-frames measured: {bank.measured_count}, "
+              f"predicted: {bank.predicted_count}")
+
+    if quality is not None:
+        print(f"[INFO] Quality: {quality.summary()}")
+    if qlog is not None:
+        qlog.close()
+        print(f"[INFO] Quality log saved to {args.quality_log}")
+
     cap.release()
     cv2.destroyAllWindows()
 
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+aruco_tune.py – Offline search for fast ArUco DetectorParameters.
+
+- Decodes a sample of frames from a video (the footage the tracker will see).
+- Reference run: exhaustive settings (dense adaptive-threshold window
+  sweep, small minimum marker size, sub-pixel corners) give the markers
+  that should be found on every frame.
+- Every candidate in SEARCH_SPACE is run on the same frames, in parallel
+  across cores (one single-threaded detector per process), and scored by
+  recall against the reference (same id, center within --match-px) and
+  time per frame. Candidates with more false or misplaced detections than
+  --max-extra (default: as many as the default parameters) are dropped.
+- The Pareto-optimal candidates (no other candidate is both faster and
+  at least as good in recall) are timed again one after another in this
+  process, so their times are not skewed by the parallel run, and saved
+  to a JSON profile.
+
+Load the profile with:
+    python src/aruco_tracker.py --params-profile aruco.json [--min-recall 0.99]
+
+Usage:
+    python src/aruco_tune.py --video sample.mp4 --out aruco.json [--jobs 32]
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing as mp
+import os
+import time
+
+import cv2
+import numpy as np
+
+from video_io import VideoSource
+from aruco_tracker import make_detector
+
+
+REFINE_NAMES = {
+    cv2.aruco.CORNER_REFINE_NONE: "none",
+    cv2.aruco.CORNER_REFINE_SUBPIX: "subpix",
+    cv2.aruco.CORNER_REFINE_CONTOUR: "contour",
+}
+
+REFERENCE_PARAMS = dict(
+    adaptiveThreshWinSizeMin=3,
+    adaptiveThreshWinSizeMax=53,
+    adaptiveThreshWinSizeStep=2,
+    polygonalApproxAccuracyRate=0.03,
+    minMarkerPerimeterRate=0.02,
+    cornerRefinementMethod=cv2.aruco.CORNER_REFINE_SUBPIX,
+)
+
+SEARCH_SPACE = dict(
+    adaptiveThreshWinSizeMin=[3, 5, 7],
+    adaptiveThreshWinSizeMax=[7, 15, 23],
+    adaptiveThreshWinSizeStep=[4, 10],
+    polygonalApproxAccuracyRate=[0.03, 0.05, 0.08],
+    minMarkerPerimeterRate=[0.03, 0.06, 0.1],
+    cornerRefinementMethod=list(REFINE_NAMES),
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Tune ArUco DetectorParameters")
+    parser.add_argument("--video", required=True, help="Sample video")
+    parser.add_argument("--out", required=True, help="Output profile (.json)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 4,
+                        help="Worker processes for the search")
+    parser.add_argument("--max-frames", type=int, default=150,
+                        help="Frames used from the sample video")
+    parser.add_argument("--stride", type=int, default=1,
+                        help="Use every N-th frame of the video")
+    parser.add_argument("--match-px", type=float, default=4.0,
+                        help="Max center distance to the reference detection")
+    parser.add_argument("--max-extra", type=int, default=None,
+                        help="Max detections not matching the reference "
+                             "(default: as many as the default parameters give)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Timing runs per Pareto candidate (best is kept)")
+    return parser.parse_args()
+
+
+def candidates():
+    names = list(SEARCH_SPACE)
+    for values in itertools.product(*(SEARCH_SPACE[n] for n in names)):
+        params = dict(zip(names, values))
+        if params["adaptiveThreshWinSizeMax"] < params["adaptiveThreshWinSizeMin"]:
+            continue
+        yield params
+
+
+def load_frames(video, max_frames, stride):
+    """Native-orientation gray frames (each in its own buffer)."""
+    cap = VideoSource(video, gray_only=True)
+    if not cap.isOpened():
+        raise IOError(f"Cannot open video: {video}")
+    frames = []
+    idx = 0
+    while len(frames) < max_frames:
+        buf = cap.new_gray_buffer()
+        ret, _, gray = cap.read(gray_out=buf)
+        if not ret:
+            break
+        if idx % stride == 0:
+            frames.append(gray)
+        idx += 1
+    cap.release()
+    return frames
+
+
+def detect_all(detector, frames):
+    """Per frame {id: center}; returns (detections, ms per frame)."""
+    out = []
+    t = time.perf_counter()
+    for gray in frames:
+        corners, ids, _ = detector.detectMarkers(gray)
+        out.append((corners, ids))
+    ms = (time.perf_counter() - t) * 1000 / max(len(frames), 1)
+
+    detections = []
+    for corners, ids in out:
+        found = {}
+        if ids is not None:
+            for pts, marker_id in zip(corners, ids.reshape(-1)):
+                found[int(marker_id)] = pts.reshape(-1, 2).mean(axis=0)
+        detections.append(found)
+    return detections, ms
+
+
+def score(detections, reference, match_px):
+    """recall, mean center error (px) of the matches, detections not in the reference."""
+    total = hits = extra = 0
+    err = 0.0
+    for found, ref in zip(detections, reference):
+        total += len(ref)
+        for marker_id, center in found.items():
+            if marker_id not in ref:
+                extra += 1
+                continue
+            d = float(np.hypot(*(center - ref[marker_id])))
+            if d <= match_px:
+                hits += 1
+                err += d
+            else:
+                extra += 1
+    recall = hits / total if total else 1.0
+    return recall, err / max(hits, 1), extra
+
+
+def pareto_front(entries):
+    """Entries no other entry beats on both ms_per_frame and recall, fastest first."""
+    front = []
+    for e in sorted(entries, key=lambda e: (e["ms_per_frame"], -e["recall"])):
+        if not front or e["recall"] > front[-1]["recall"]:
+            front.append(e)
+    return front
+
+
+# ----------------------------------------------------------------------
+# workers
+# ----------------------------------------------------------------------
+
+_frames = None
+_reference = None
+_match_px = None
+
+
+def _init_worker(video, max_frames, stride, reference, match_px):
+    global _frames, _reference, _match_px
+    # one process per core; keep cv2 single-threaded so times compare
+    cv2.setNumThreads(1)
+    _frames = load_frames(video, max_frames, stride)
+    _reference = [{k: np.asarray(v) for k, v in ref.items()} for ref in reference]
+    _match_px = match_px
+
+
+def _evaluate(params):
+    detections, ms = detect_all(make_detector(params), _frames)
+    recall, center_err, extra = score(detections, _reference, _match_px)
+    return dict(params=params, recall=recall, ms_per_frame=ms,
+                center_error_px=center_err, extra=extra)
+
+
+def describe(entry):
+    p = dict(entry["params"])
+    if "cornerRefinementMethod" in p:
+        p["cornerRefinementMethod"] = REFINE_NAMES.get(p["cornerRefinementMethod"],
+                                                       p["cornerRefinementMethod"])
+    return (f"recall {entry['recall']:.3f}  {entry['ms_per_frame']:6.2f} ms/frame  "
+            f"extra {entry['extra']:3d}  {p}")
+
+
+def main():
+    args = parse_args()
+    cv2.setNumThreads(1)
+
+    try:
+        frames = load_frames(args.video, args.max_frames, args.stride)
+    except IOError as e:
+        print(f"[ERROR] {e}")
+        return
+    if not frames:
+        print("[ERROR] Empty video.")
+        return
+    print(f"[INFO] {len(frames)} sample frames of {frames[0].shape[1]}x{frames[0].shape[0]}.")
+
+    reference, ref_ms = detect_all(make_detector(REFERENCE_PARAMS), frames)
+    n_ref = sum(len(r) for r in reference)
+    print(f"[INFO] Reference run: {n_ref} marker detections, {ref_ms:.2f} ms/frame.")
+    if n_ref == 0:
+        print("[ERROR] No markers in the reference run; pick footage that shows them.")
+        return
+
+    default_detections, default_ms = detect_all(make_detector(), frames)
+    recall, center_err, extra = score(default_detections, reference, args.match_px)
+    default = dict(params={}, recall=recall, ms_per_frame=default_ms,
+                   center_error_px=center_err, extra=extra)
+    print(f"[INFO] Defaults:  {describe(default)}")
+
+    grid = list(candidates())
+    ref_lists = [{k: v.tolist() for k, v in ref.items()} for ref in reference]
+    print(f"[INFO] Searching {len(grid)} parameter sets on {args.jobs} processes.")
+    results = []
+    t = time.perf_counter()
+    with mp.Pool(args.jobs, initializer=_init_worker,
+                 initargs=(args.video, args.max_frames, args.stride,
+                           ref_lists, args.match_px)) as pool:
+        for i, res in enumerate(pool.imap_unordered(_evaluate, grid, chunksize=4), 1):
+            results.append(res)
+            if i % max(1, len(grid) // 10) == 0:
+                print(f"[INFO] {i}/{len(grid)} done ({time.perf_counter() - t:.0f}s)")
+
+    # false or misplaced markers disqualify a candidate outright: the front
+    # only trades recall for time among candidates that are not noisier
+    # than the defaults
+    max_extra = default["extra"] if args.max_extra is None else args.max_extra
+    clean = [e for e in results if e["extra"] <= max_extra]
+    print(f"[INFO] {len(clean)} of {len(results)} sets have <= {max_extra} "
+          f"detections not in the reference.")
+    if not clean:
+        print("[ERROR] No parameter set meets --max-extra.")
+        return
+
+    # re-time the front on its own (parallel times include contention), then
+    # recompute the front with the clean times
+    front = pareto_front(clean)
+    for entry in front:
+        detector = make_detector(entry["params"])
+        entry["ms_per_frame"] = min(detect_all(detector, frames)[1]
+                                    for _ in range(max(1, args.repeat)))
+    front = pareto_front(front)
+
+    print(f"[INFO] Pareto front ({len(front)} of {len(results)}):")
+    for entry in front:
+        print(f"  {describe(entry)}")
+
+    profile = {
+        "video": args.video,
+        "frames": len(frames),
+        "stride": args.stride,
+        "match_px": args.match_px,
+        "max_extra": max_extra,
+        "dictionary": "DICT_4X4_50",
+        "reference": dict(params=REFERENCE_PARAMS, markers=n_ref, ms_per_frame=ref_ms),
+        "default": default,
+        "pareto": front,
+    }
+    with open(args.out, "w") as f:
+        json.dump(profile, f, indent=2)
+    print(f"[INFO] Profile saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
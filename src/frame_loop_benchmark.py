@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+frame_loop_benchmark.py – Per-frame allocation and latency jitter of the
+steady-state tracker loops, before and after the buffer pool.
+
+For the KLT loop and the SAM2 overlay loop it runs two variants on the same
+synthetic portrait clip (so the rotation path is exercised):
+
+- baseline: the previous per-frame code (cv2.rotate / cvtColor / copy /
+  astype / addWeighted each returning a new full-frame array)
+- pooled:   the trackers' own loops, klt_tracker.KLTLoop and
+  sam2_tracker.MaskPlayback, so a regression there shows up here
+
+Per-frame allocation is the tracemalloc peak above the memory in use at
+the start of the frame, after a warm-up. Latency is measured in --repeat
+further runs without tracemalloc (median of the per-run mean / p99). GUI
+calls (imshow / waitKey) are left out.
+
+PASS needs the pooled loops to allocate < ALLOC_LIMIT per frame AND to be
+no slower than baseline (mean and p99) by more than --tolerance.
+
+Usage:
+    python src/frame_loop_benchmark.py [--frames 300] [--warmup 20] [--repeat 3]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from video_io import VideoSource
+from klt_tracker import KLTLoop, detect_features, track_points, update_box
+from sam2_tracker import MaskPlayback
+from tracking_service_harness import make_test_video
+
+
+ALLOC_LIMIT = 64 * 1024     # "near zero": well below one 480x640 gray frame
+
+
+def _rotate_if_portrait(frame):
+    h, w = frame.shape[:2]
+    if h > w:
+        frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
+    return frame
+
+
+# ----------------------------------------------------------------------
+# KLT loops
+# ----------------------------------------------------------------------
+
+def klt_baseline(video, roi_box):
+    cap = cv2.VideoCapture(video)
+    ret, frame = cap.read()
+    frame = _rotate_if_portrait(frame)
+    old_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    box = roi_box.copy()
+    p0 = detect_features(old_gray, box)
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame = _rotate_if_portrait(frame)
+        frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        good_new = np.array(track_points(old_gray, frame_gray, p0)).reshape(-1, 2)
+        box = update_box(good_new, box)
+        x1, y1, x2, y2 = box.astype(int)
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 3)
+        for (cx, cy) in good_new:
+            cv2.circle(frame, (int(cx), int(cy)), 4, (0, 255, 0), -1)
+        old_gray = frame_gray.copy()
+        p0 = good_new.reshape(-1, 1, 2)
+        yield
+    cap.release()
+
+
+def klt_pooled(video, roi_box):
+    cap = VideoSource(video)
+    ret, frame, gray = cap.read()
+    loop = KLTLoop(cap, gray, cap.to_native_box(roi_box))
+    while loop.step():
+        yield
+    cap.release()
+
+
+# ----------------------------------------------------------------------
+# SAM2 overlay loops
+# ----------------------------------------------------------------------
+
+def sam2_baseline(video, masks):
+    cap = cv2.VideoCapture(video)
+    frame_idx = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame = _rotate_if_portrait(frame)
+        mask = masks[min(frame_idx, len(masks) - 1)]
+        mask_bin = (mask > 0).astype(np.uint8)
+        ys, xs = np.where(mask_bin == 1)
+        overlay = frame.copy()
+        overlay[mask_bin == 1] = (0, 255, 0)
+        vis = cv2.addWeighted(overlay, 0.4, frame, 0.6, 0)
+        if len(xs) > 0:
+            cv2.rectangle(vis, (int(xs.min()), int(ys.min())),
+                          (int(xs.max()), int(ys.max())), (0, 0, 255), 2)
+        frame_idx += 1
+        yield
+    cap.release()
+
+
+def sam2_pooled(video, masks):
+    cap = VideoSource(video, need_gray=False)
+    playback = MaskPlayback(cap, masks)
+    while playback.step():
+        yield
+    cap.release()
+
+
+# ----------------------------------------------------------------------
+# measurement
+# ----------------------------------------------------------------------
+
+def measure(make_loop, warmup, trace):
+    """Per-frame (alloc bytes, seconds) after warm-up."""
+    loop = make_loop()
+    allocs, times = [], []
+    i = 0
+    while True:
+        if trace:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        t = time.perf_counter()
+        try:
+            next(loop)
+        except StopIteration:
+            break
+        dt = time.perf_counter() - t
+        if i >= warmup:
+            times.append(dt)
+            if trace:
+                allocs.append(tracemalloc.get_traced_memory()[1] - before)
+        i += 1
+    return np.array(allocs), np.array(times)
+
+
+def report(name, make_loop, warmup, repeat):
+    """Returns (median alloc bytes, mean ms, p99 ms) per frame."""
+    tracemalloc.start()
+    allocs, _ = measure(make_loop, warmup, trace=True)
+    tracemalloc.stop()
+    means, p99s = [], []
+    for _ in range(max(1, repeat)):
+        _, times = measure(make_loop, warmup, trace=False)
+        ms = times * 1000
+        means.append(ms.mean())
+        p99s.append(np.percentile(ms, 99))
+    mean, p99 = float(np.median(means)), float(np.median(p99s))
+    print(f"{name:<16} alloc/frame median {np.median(allocs) / 1024:9.1f} KB  "
+          f"max {allocs.max() / 1024:9.1f} KB | latency mean {mean:6.2f} ms  "
+          f"p99 {p99:6.2f} ms")
+    return np.median(allocs), mean, p99
+
+
+def compare(name, base, pooled, tolerance):
+    alloc_ok = pooled[0] < ALLOC_LIMIT
+    mean_ok = pooled[1] <= base[1] * (1 + tolerance)
+    p99_ok = pooled[2] <= base[2] * (1 + tolerance)
+    ok = alloc_ok and mean_ok and p99_ok
+    print(f"[{'PASS' if ok else 'FAIL'}] {name}: alloc {pooled[0] / 1024:.0f} KB "
+          f"(limit {ALLOC_LIMIT // 1024} KB, baseline {base[0] / 1024:.0f} KB), "
+          f"mean {pooled[1]:.2f} vs {base[1]:.2f} ms, "
+          f"p99 {pooled[2]:.2f} vs {base[2]:.2f} ms (tolerance {tolerance:.0%})")
+    return ok
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Frame loop allocation benchmark")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Latency runs per loop (median is reported)")
+    parser.add_argument("--tolerance", type=float, default=0.05,
+                        help="Allowed latency excess of pooled over baseline")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    tmp = tempfile.mkdtemp(prefix="frame_loop_")
+    video = os.path.join(tmp, "portrait.mp4")
+    boxes = make_test_video(video, n_frames=args.frames, size=(480, 640))
+
+    # the clip is portrait, so tracking boxes/masks refer to the upright frame
+    probe = VideoSource(video)
+    H, W = probe.height, probe.width
+    roi_upright = probe.to_upright_box(np.array(boxes[0], dtype=np.float32))
+    masks = np.zeros((len(boxes), H, W), dtype=np.uint8)
+    for m, box in zip(masks, boxes):
+        x1, y1, x2, y2 = probe.to_upright_box(np.array(box, dtype=np.float32)).astype(int)
+        m[y1:y2, x1:x2] = 1
+    probe.release()
+
+    print(f"[INFO] {args.frames} frames of {W}x{H} (portrait source), "
+          f"warm-up {args.warmup}")
+    r = args.repeat
+    klt_base = report("klt baseline", lambda: klt_baseline(video, roi_upright), args.warmup, r)
+    klt_pool = report("klt pooled", lambda: klt_pooled(video, roi_upright), args.warmup, r)
+    sam_base = report("sam2 baseline", lambda: sam2_baseline(video, masks), args.warmup, r)
+    sam_pool = report("sam2 pooled", lambda: sam2_pooled(video, masks), args.warmup, r)
+
+    os.unlink(video)
+    os.rmdir(tmp)
+
+    ok = compare("klt", klt_base, klt_pool, args.tolerance)
+    ok = compare("sam2", sam_base, sam_pool, args.tolerance) and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
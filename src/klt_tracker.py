@@ -5,44 +5,239 @@ klt_tracker.py — FINAL CRASH-PROOF VERSION
 - ROI always visible
 - KLT optical flow updates ROI only when valid
 - Never crashes even with malformed LK results
-- Portrait videos auto-rotated
+- Portrait videos auto-rotated (orientation fixed once by VideoSource)
+- Optional motion gate (--motion-gate): still frames reuse the last result
+- Optional adaptive quality (--target-fps): point count, LK window / pyramid
+  depth and processing resolution drop when frames take too long
 """
 
 import cv2
 import argparse
+import time
 import numpy as np
 
+from video_io import VideoSource
+from trajectory_store import TrajectoryWriter
+from motion_gate import MotionGate
+from quality_controller import KLT_LEVELS, QualityController, QualityLog
+
+
+# Robust feature detection
+FEATURE_PARAMS = dict(
+    maxCorners=400,
+    qualityLevel=0.001,
+    minDistance=4,
+    blockSize=5
+)
+
+# Lucas–Kanade optical flow parameters
+LK_PARAMS = dict(
+    winSize=(21, 21),
+    maxLevel=3,
+    criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01)
+)
+
+
+def detect_features(gray, box, feature_params=FEATURE_PARAMS):
+    """Shi-Tomasi corners inside box (x1, y1, x2, y2) as an (N,1,2) array."""
+    mask = np.zeros_like(gray)
+    x1, y1, x2, y2 = np.asarray(box).astype(int)
+    mask[y1:y2, x1:x2] = 255
+    p0 = cv2.goodFeaturesToTrack(gray, mask=mask, **feature_params)
+    if p0 is None:
+        p0 = np.zeros((0, 1, 2), dtype=np.float32)
+    return p0
+
+
+def track_points(old_gray, gray, p0, lk_params=LK_PARAMS):
+    """Track p0 from old_gray to gray; returns the surviving points as (N,2)."""
+    # === Compute optical flow safely ===
+    if len(p0) > 0:
+        p1, st, err = cv2.calcOpticalFlowPyrLK(
+            old_gray, gray, p0, None, **lk_params
+        )
+
+        # Handle p1=None or malformed
+        if p1 is None or st is None:
+            good_new = np.zeros((0, 2), dtype=np.float32)
+        else:
+            st = st.reshape(-1)
+            valid = st == 1
+            good_new = p1[valid] if np.any(valid) else np.zeros((0, 2), dtype=np.float32)
+    else:
+        good_new = np.zeros((0, 2), dtype=np.float32)
+
+    # === Normalize shape to (N,2) ALWAYS (no copy if already float32) ===
+    return np.asarray(good_new, dtype=np.float32).reshape(-1, 2)
+
+
+def update_box(good_new, box):
+    """Bounding box of the tracked points, or the old box if fewer than 4."""
+    if good_new.shape[0] >= 4:
+        x_min = float(np.min(good_new[:, 0]))
+        y_min = float(np.min(good_new[:, 1]))
+        x_max = float(np.max(good_new[:, 0]))
+        y_max = float(np.max(good_new[:, 1]))
+        return np.array([x_min, y_min, x_max, y_max], dtype=np.float32)
+    return box
+
+
+def quality_params(q):
+    """FEATURE_PARAMS / LK_PARAMS for a quality_controller.Quality level."""
+    feature_params = dict(FEATURE_PARAMS, maxCorners=q.max_corners)
+    lk_params = dict(LK_PARAMS, winSize=(q.win_size, q.win_size), maxLevel=q.max_level)
+    return feature_params, lk_params
+
+
+def refit_points(gray, box, p0, feature_params, old_cap, margin):
+    """
+    Fit p0 to a new point budget. A lower cap keeps the strongest points
+    (goodFeaturesToTrack order, tracked points first). A higher cap adds
+    new features found in box grown by margin px, away from the existing
+    points, which are kept as they are.
+    """
+    n = feature_params["maxCorners"]
+    if n <= old_cap:
+        return p0[:n]
+
+    h, w = gray.shape[:2]
+    x1, y1, x2, y2 = np.asarray(box, dtype=np.float32)
+    grown = (max(0, x1 - margin), max(0, y1 - margin),
+             min(w, x2 + margin), min(h, y2 + margin))
+    old = p0.reshape(-1, 2)
+    new = detect_features(gray, grown, feature_params).reshape(-1, 2)
+    if len(old) and len(new):
+        dist = np.linalg.norm(new[:, None, :] - old[None, :, :], axis=2).min(axis=1)
+        new = new[dist >= feature_params["minDistance"]]
+    merged = np.vstack([old, new])[:n]
+    return merged.astype(np.float32).reshape(-1, 1, 2)
+
+
+class KLTLoop:
+    """
+    The steady-state tracking loop; step() handles one frame.
+
+    Tracking runs in native orientation; only display is rotated.
+    old_gray / next_gray ping-pong: each frame is decoded into next_gray
+    and the two are swapped once it has been processed (no per-frame copy).
+    Below full resolution (set_quality), flow runs on a second ping-pong
+    pair of downscaled frames; points and box stay in full-resolution
+    coordinates.
+
+    After step(): frame (upright, annotated), box (native), good_new,
+    n_prev (points before this frame) and frame_idx describe the frame.
+    """
+
+    def __init__(self, cap, gray, roi_box, motion_gate=False):
+        self.cap = cap
+        self.old_gray = gray.copy()
+        self.next_gray = cap.new_gray_buffer()
+        self.box = roi_box
+        self.feature_params, self.lk_params = FEATURE_PARAMS, LK_PARAMS
+        self.p0 = detect_features(self.old_gray, roi_box)
+        self.scale = 1.0
+        self.old_small = self.next_small = None
+
+        self.gate = None
+        if motion_gate:
+            self.gate = MotionGate()
+            self.gate.prime(self.old_gray)
+        # flow around the box is affected by motion up to one LK window away
+        self.margin = np.array([-1, -1, 1, 1], dtype=np.float32) * LK_PARAMS["winSize"][0]
+
+        self.frame_idx = 0
+        self.frame = None
+        self.good_new = self.p0.reshape(-1, 2)
+        self.n_prev = len(self.p0)
+
+    def step(self):
+        """Track the next frame; False at the end of the video."""
+        cap = self.cap
+        ret, frame, frame_gray = cap.read(gray_out=self.next_gray)
+        if not ret:
+            return False
+        self.frame_idx += 1
+        p0 = self.p0
+        self.n_prev = len(p0)
+
+        if self.gate is not None and self.gate.is_static(frame_gray, self.box + self.margin):
+            # Nothing moved since the last processed frame: reuse its result
+            # and keep old_gray, so flow resumes from that frame
+            good_new = p0.reshape(-1, 2)
+        else:
+            if self.scale == 1.0:
+                good_new = track_points(self.old_gray, frame_gray, p0, self.lk_params)
+            else:
+                cv2.resize(frame_gray, self.next_small.shape[::-1], dst=self.next_small,
+                           interpolation=cv2.INTER_AREA)
+                good_new = track_points(self.old_small, self.next_small,
+                                        p0 * self.scale, self.lk_params) / self.scale
+                self.old_small, self.next_small = self.next_small, self.old_small
+
+            # === Update ROI ONLY if enough points exist ===
+            self.box = update_box(good_new, self.box)
+
+            # Update for next iteration
+            self.old_gray, self.next_gray = self.next_gray, self.old_gray
+
+        # === ALWAYS DRAW ROI, even if 0 points ===
+        frame = cap.upright(frame)
+        x1, y1, x2, y2 = cap.to_upright_box(self.box).astype(int)
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 3)
+
+        # === Draw tracked points ===
+        for (cx, cy) in cap.to_upright_points(good_new):
+            cv2.circle(frame, (int(cx), int(cy)), 4, (0, 255, 0), -1)
+
+        self.frame = frame
+        self.good_new = good_new
+        self.p0 = good_new.reshape(-1, 1, 2) if good_new.shape[0] > 0 else np.zeros((0, 1, 2), dtype=np.float32)
+        return True
+
+    def set_quality(self, q):
+        """Switch to a quality_controller.Quality level."""
+        old_cap = self.feature_params["maxCorners"]
+        self.feature_params, self.lk_params = quality_params(q)
+        self.p0 = refit_points(self.old_gray, self.box, self.p0, self.feature_params,
+                               old_cap, margin=self.feature_params["blockSize"])
+        if q.scale != self.scale:
+            self.scale = q.scale
+            if self.scale != 1.0:
+                h, w = self.old_gray.shape
+                size = (max(1, int(w * self.scale)), max(1, int(h * self.scale)))
+                self.old_small = cv2.resize(self.old_gray, size, interpolation=cv2.INTER_AREA)
+                self.next_small = np.empty_like(self.old_small)
+
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Markerless Lucas-Kanade tracker")
     parser.add_argument("--video", required=True, help="Path to video file")
+    parser.add_argument("--traj", default=None,
+                        help="Optional .traj file to record the ROI trajectory")
+    parser.add_argument("--motion-gate", action="store_true",
+                        help="Skip optical flow while nothing moves around the ROI")
+    parser.add_argument("--target-fps", type=float, default=None,
+                        help="Lower tracking quality as needed to hold this frame rate")
+    parser.add_argument("--quality-log", default=None,
+                        help="CSV of per-frame latency and quality settings (--target-fps)")
     return parser.parse_args()
 
 
-def ensure_upright(frame):
-    """Rotate portrait video (H > W) into landscape (W >= H)."""
-    h, w = frame.shape[:2]
-    if h > w:
-        frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
-    return frame
-
-
 def main():
     args = parse_args()
 
-    cap = cv2.VideoCapture(args.video)
+    cap = VideoSource(args.video)
     if not cap.isOpened():
         print("[ERROR] Cannot open video.")
         return
 
     # Read first frame
-    ret, frame = cap.read()
+    ret, frame, gray = cap.read()
     if not ret:
         print("[ERROR] Empty video.")
         return
 
-    frame = ensure_upright(frame)
-    old_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    frame = cap.upright(frame)
     H, W = frame.shape[:2]
 
     # ROI selection
@@ -58,93 +253,71 @@ def main():
         print("[ERROR] Invalid ROI.")
         return
 
-    # ROI bounding box, always drawn
+    # ROI bounding box (native coordinates), always drawn
     roi_box = np.array([x, y, x + w, y + h], dtype=np.float32)
+    roi_box = cap.to_native_box(roi_box)
 
-    # Create feature mask
-    mask = np.zeros_like(old_gray)
-    mask[y:y + h, x:x + w] = 255
+    loop = KLTLoop(cap, gray, roi_box, motion_gate=args.motion_gate)
 
-    # Robust feature detection
-    feature_params = dict(
-        maxCorners=400,
-        qualityLevel=0.001,
-        minDistance=4,
-        blockSize=5
-    )
-
-    p0 = cv2.goodFeaturesToTrack(old_gray, mask=mask, **feature_params)
-    if p0 is None:
-        p0 = np.zeros((0, 1, 2), dtype=np.float32)
-
-    print(f"[INFO] Initial features detected: {len(p0)}")
-
-    # Lucas–Kanade optical flow parameters
-    lk_params = dict(
-        winSize=(21, 21),
-        maxLevel=3,
-        criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01)
-    )
+    print(f"[INFO] Initial features detected: {len(loop.p0)}")
 
     cv2.namedWindow("KLT Tracker", cv2.WINDOW_NORMAL)
     cv2.resizeWindow("KLT Tracker", W, H)
 
-    print("[INFO] Tracking started. Press q to quit.")
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        frame = ensure_upright(frame)
-        frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-        # === Compute optical flow safely ===
-        if len(p0) > 0:
-            p1, st, err = cv2.calcOpticalFlowPyrLK(
-                old_gray, frame_gray, p0, None, **lk_params
-            )
-
-            # Handle p1=None or malformed
-            if p1 is None or st is None:
-                good_new = np.zeros((0, 2), dtype=np.float32)
-            else:
-                st = st.reshape(-1)
-                valid = st == 1
-                good_new = p1[valid] if np.any(valid) else np.zeros((0, 2), dtype=np.float32)
-        else:
-            good_new = np.zeros((0, 2), dtype=np.float32)
+    traj = None
+    if args.traj:
+        traj = TrajectoryWriter(args.traj, meta={
+            "tracker": "klt", "video": args.video, "fps": cap.fps,
+            "width": W, "height": H,
+        })
 
-        # === Normalize shape to (N,2) ALWAYS ===
-        good_new = np.array(good_new, dtype=np.float32).reshape(-1, 2)
+    quality = qlog = None
+    if args.target_fps:
+        quality = QualityController(KLT_LEVELS, args.target_fps)
+        if args.quality_log:
+            qlog = QualityLog(args.quality_log)
 
-        # === Update ROI ONLY if enough points exist ===
-        if good_new.shape[0] >= 4:
-            x_min = float(np.min(good_new[:, 0]))
-            y_min = float(np.min(good_new[:, 1]))
-            x_max = float(np.max(good_new[:, 0]))
-            y_max = float(np.max(good_new[:, 1]))
-            roi_box = np.array([x_min, y_min, x_max, y_max], dtype=np.float32)
-
-        # === ALWAYS DRAW ROI, even if 0 points ===
-        x1, y1, x2, y2 = roi_box.astype(int)
-        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 3)
+    print("[INFO] Tracking started. Press q to quit.")
 
-        # === Draw tracked points ===
-        for (cx, cy) in good_new:
-            cv2.circle(frame, (int(cx), int(cy)), 4, (0, 255, 0), -1)
+    t_last = time.perf_counter()
+    while loop.step():
+        frame_idx = loop.frame_idx
+        if traj is not None:
+            # confidence = fraction of last frame's features still tracked
+            traj.append(frame_idx, cap.frame_time(frame_idx), 0,
+                        cap.to_upright_box(loop.box),
+                        confidence=loop.good_new.shape[0] / max(loop.n_prev, 1))
 
         # Show frame
-        cv2.imshow("KLT Tracker", frame)
-
-        # Update for next iteration
-        old_gray = frame_gray.copy()
-        p0 = good_new.reshape(-1, 1, 2) if good_new.shape[0] > 0 else np.zeros((0, 1, 2), dtype=np.float32)
+        cv2.imshow("KLT Tracker", loop.frame)
 
         # Exit
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
 
+        if quality is not None:
+            now = time.perf_counter()
+            latency, t_last = now - t_last, now
+            if qlog is not None:
+                qlog.write(frame_idx, latency, quality)
+            if quality.update(latency):
+                loop.set_quality(quality.settings)
+                print(f"[INFO] Frame {frame_idx}: quality level {quality.level} "
+                      f"{quality.settings}")
+
+    if traj is not None:
+        traj.close()
+        print(f"[INFO] Trajectory saved to {args.traj}")
+
+    if loop.gate is not None:
+        print(f"[INFO] Motion gate: {loop.gate.summary()}")
+
+    if quality is not None:
+        print(f"[INFO] Quality: {quality.summary()}")
+    if qlog is not None:
+        qlog.close()
+        print(f"[INFO] Quality log saved to {args.quality_log}")
+
     cap.release()
     cv2.destroyAllWindows()
 
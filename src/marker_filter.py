@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+marker_filter.py – Per-marker constant-velocity Kalman filters for ArUco.
+
+Each marker id gets a cv2.KalmanFilter over its 4 corners:
+    state       = 8 corner coordinates + their 8 velocities (px / frame)
+    measurement = 8 corner coordinates from detectMarkers
+
+This lets aruco_tracker run detection only every N-th frame and report
+predicted corners in between, and lets a marker coast through a short
+occlusion. While coasting, the position uncertainty (sigma, in px) grows
+with every predict step; the track is dropped after max_coast frames
+without a measurement.
+"""
+
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+
+# corners: (1, 4, 2) float32 like detectMarkers, sigma: px std of corner position
+MarkerEstimate = namedtuple("MarkerEstimate", "id corners measured sigma")
+
+
+def _make_kalman(corners, process_noise, measurement_noise):
+    kf = cv2.KalmanFilter(16, 8)
+    eye = np.eye(8, dtype=np.float32)
+    zero = np.zeros((8, 8), dtype=np.float32)
+
+    # x_k = x_{k-1} + v_{k-1},  v_k = v_{k-1}   (dt = 1 frame)
+    kf.transitionMatrix = np.block([[eye, eye], [zero, eye]]).astype(np.float32)
+    kf.measurementMatrix = np.hstack([eye, zero]).astype(np.float32)
+
+    # white-acceleration noise model for dt = 1
+    q = process_noise
+    kf.processNoiseCov = np.block([
+        [eye * (q / 3.0), eye * (q / 2.0)],
+        [eye * (q / 2.0), eye * q],
+    ]).astype(np.float32)
+    kf.measurementNoiseCov = eye * measurement_noise
+
+    kf.statePost = np.vstack([
+        corners.reshape(8, 1), np.zeros((8, 1), dtype=np.float32)
+    ]).astype(np.float32)
+    kf.errorCovPost = np.diag(
+        [measurement_noise] * 8 + [100.0] * 8
+    ).astype(np.float32)
+    return kf
+
+
+class _Track:
+    def __init__(self, marker_id, corners, frame_idx, process_noise, measurement_noise):
+        self.id = marker_id
+        self.kf = _make_kalman(corners, process_noise, measurement_noise)
+        self.frame_idx = frame_idx          # frame the state refers to
+        self.last_measured = frame_idx
+
+    def predict_to(self, frame_idx):
+        while self.frame_idx < frame_idx:
+            # cv2 copies statePre/errorCovPre into statePost/errorCovPost,
+            # so consecutive predicts accumulate uncertainty
+            self.kf.predict()
+            self.frame_idx += 1
+
+    def correct(self, corners, frame_idx):
+        self.kf.correct(corners.reshape(8, 1).astype(np.float32))
+        self.last_measured = frame_idx
+
+    def corners(self):
+        return self.kf.statePost[:8].reshape(1, 4, 2).copy()
+
+    def sigma(self):
+        return float(np.sqrt(np.mean(np.diag(self.kf.errorCovPost)[:8])))
+
+
+class MarkerFilterBank:
+    """
+    Call step() once per frame, in frame order.
+
+    detected=False means detection was not run on this frame (reduced-rate
+    mode): every track is predicted. detected=True with a marker missing
+    means it was not seen: its track coasts until max_coast is exceeded.
+    """
+
+    def __init__(self, max_coast=15, process_noise=1.0, measurement_noise=1.0):
+        self.max_coast = max_coast
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.tracks = {}
+        self.measured_count = 0     # marker-frames reported from a detection
+        self.predicted_count = 0    # marker-frames reported from the filter
+
+    def step(self, frame_idx, corners=None, ids=None, detected=True):
+        """Return a list of MarkerEstimate for frame_idx, sorted by id."""
+        for track in self.tracks.values():
+            track.predict_to(frame_idx)
+
+        measured = {}
+        if detected and ids is not None:
+            for pts, marker_id in zip(corners, ids):
+                marker_id = int(marker_id)
+                pts = np.asarray(pts, dtype=np.float32).reshape(1, 4, 2)
+                measured[marker_id] = pts
+                track = self.tracks.get(marker_id)
+                if track is None:
+                    self.tracks[marker_id] = _Track(
+                        marker_id, pts, frame_idx,
+                        self.process_noise, self.measurement_noise
+                    )
+                else:
+                    track.correct(pts, frame_idx)
+
+        out = []
+        for marker_id in sorted(self.tracks):
+            track = self.tracks[marker_id]
+            if frame_idx - track.last_measured > self.max_coast:
+                del self.tracks[marker_id]
+                continue
+            if marker_id in measured:
+                # report the detection itself on measured frames
+                out.append(MarkerEstimate(marker_id, measured[marker_id],
+                                          True, track.sigma()))
+                self.measured_count += 1
+            else:
+                out.append(MarkerEstimate(marker_id, track.corners(),
+                                          False, track.sigma()))
+                self.predicted_count += 1
+        return out
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+motion_gate.py – Cheap change detector to skip tracking work on still frames.
+
+Each gray frame is shrunk to a small thumbnail (INTER_AREA averages away
+sensor noise) and compared with the thumbnail of the last frame that was
+actually PROCESSED. Comparing against the last processed frame rather than
+the previous one means slow drift still adds up and triggers processing.
+
+A frame counts as static when no thumbnail pixel inside the region of
+interest changed by more than `threshold` gray levels. The first moving
+frame is processed immediately, so results on moving content are the same
+as without the gate.
+"""
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    def __init__(self, scale=0.125, threshold=6, min_changed=1):
+        self.scale = scale
+        self.threshold = threshold
+        self.min_changed = min_changed
+        self._thumb = None
+        self._ref = None
+        self._diff = None
+        self.frames = 0
+        self.skipped = 0
+
+    def _thumb_size(self, gray):
+        h, w = gray.shape[:2]
+        return max(1, int(w * self.scale)), max(1, int(h * self.scale))
+
+    def _shrink(self, gray):
+        tw, th = self._thumb_size(gray)
+        if self._thumb is None or self._thumb.shape != (th, tw):
+            self._thumb = np.empty((th, tw), dtype=np.uint8)
+            self._diff = np.empty((th, tw), dtype=np.uint8)
+            self._ref = None
+        cv2.resize(gray, (tw, th), dst=self._thumb, interpolation=cv2.INTER_AREA)
+        return tw, th
+
+    def prime(self, gray):
+        """Use gray (e.g. the tracker's first frame) as the reference."""
+        self._shrink(gray)
+        self._ref = self._thumb.copy()
+
+    def is_static(self, gray, roi=None):
+        """
+        True if gray matches the last processed frame inside roi
+        (x1, y1, x2, y2 in full-resolution pixels, None = whole frame).
+        A False result marks gray as the new reference.
+        """
+        self.frames += 1
+        tw, th = self._shrink(gray)
+
+        if self._ref is None:
+            self._ref = self._thumb.copy()
+            return False
+
+        cv2.absdiff(self._thumb, self._ref, dst=self._diff)
+        diff = self._diff
+        if roi is not None:
+            x1, y1, x2, y2 = roi
+            x1 = max(0, int(x1 * self.scale))
+            y1 = max(0, int(y1 * self.scale))
+            x2 = min(tw, int(np.ceil(x2 * self.scale)) + 1)
+            y2 = min(th, int(np.ceil(y2 * self.scale)) + 1)
+            diff = diff[y1:y2, x1:x2]
+
+        if np.count_nonzero(diff > self.threshold) < self.min_changed:
+            self.skipped += 1
+            return True
+
+        np.copyto(self._ref, self._thumb)
+        return False
+
+    def summary(self):
+        pct = 100.0 * self.skipped / max(self.frames, 1)
+        return f"skipped {self.skipped} / {self.frames} frames ({pct:.1f}%)"
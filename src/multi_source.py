@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+multi_source.py – Concurrent multi-camera ingestion with a shared scheduler.
+
+- One capture thread per source (camera index or video file).
+- Every frame is stamped on a common monotonic clock right after decode.
+- Frames are dispatched round-robin across sources to a bounded worker
+  pool, so a fast or busy camera cannot starve the others. Workers a
+  source's fair share leaves idle (e.g. a finished file source) go to the
+  sources that still have frames queued.
+- Results come back as ONE stream ordered by capture timestamp.
+
+Video files behave like cameras here, which is how the mode is tested:
+file sources block when their queue is full (no frame is lost), live
+cameras drop their oldest queued frame instead of lagging behind.
+
+cv2 releases the GIL inside detection / optical flow, so a thread pool
+scales across cores without one interpreter per camera.
+"""
+
+import heapq
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from video_io import VideoSource
+
+
+# gray is a private copy, safe to keep after the next read of the source
+Frame = namedtuple("Frame", "timestamp source frame_idx gray")
+SourceResult = namedtuple("SourceResult", "timestamp source frame_idx result")
+
+
+def parse_source(token):
+    """'0' -> camera 0, anything else is a video path."""
+    return int(token) if token.isdigit() else token
+
+
+class MultiSourceScheduler:
+    """
+    Run process(frame) over N sources and merge results in time order.
+
+    process is called from worker threads with a Frame and must be
+    thread-safe (e.g. keep one cv2 detector per thread).
+    """
+
+    def __init__(self, sources, process, workers=4, queue_size=4,
+                 max_inflight_per_source=None):
+        self.sources = [VideoSource(s) if not isinstance(s, VideoSource) else s
+                        for s in sources]
+        for s, src in zip(sources, self.sources):
+            if not src.isOpened():
+                raise IOError(f"Could not open video source: {s}")
+
+        n = len(self.sources)
+        self.process = process
+        self.workers = workers
+        self.queue_size = queue_size
+        if max_inflight_per_source is None:
+            max_inflight_per_source = max(1, -(-workers // n))   # ceil
+        self.max_inflight_per_source = max_inflight_per_source
+
+        self._cond = threading.Condition()
+        self._queues = [deque() for _ in range(n)]
+        self._drop_oldest = [not isinstance(s.source, str) for s in self.sources]
+        self._reading_ts = [None] * n       # stamped but not yet queued
+        self._done = [False] * n
+        self._inflight = {}                 # (source, frame_idx) -> timestamp
+        self._inflight_per_source = [0] * n
+        self._completed = []                # heap of SourceResult
+        self._rr = 0
+        self._stop = False
+        self._error = None
+
+        self.captured = [0] * n
+        self.dropped = [0] * n
+        self.processed = [0] * n
+
+    # ------------------------------------------------------------------
+    # capture side
+    # ------------------------------------------------------------------
+
+    def _capture_loop(self, i):
+        src = self.sources[i]
+        q = self._queues[i]
+        frame_idx = 0
+        try:
+            while not self._stop:
+                ret, _, gray = src.read()
+                if not ret:
+                    break
+                with self._cond:
+                    ts = time.monotonic()
+                    self._reading_ts[i] = ts
+
+                frame = Frame(ts, i, frame_idx, gray.copy())
+                frame_idx += 1
+
+                with self._cond:
+                    while (len(q) >= self.queue_size and not self._drop_oldest[i]
+                           and not self._stop):
+                        self._cond.wait()
+                    if len(q) >= self.queue_size:
+                        q.popleft()
+                        self.dropped[i] += 1
+                    q.append(frame)
+                    self._reading_ts[i] = None
+                    self.captured[i] += 1
+                    self._cond.notify_all()
+        except Exception as e:  # surfaced by results(), like process() errors
+            with self._cond:
+                self._error = e
+        finally:
+            src.release()
+            with self._cond:
+                self._reading_ts[i] = None
+                self._done[i] = True
+                self._cond.notify_all()
+
+    # ------------------------------------------------------------------
+    # scheduling side (called with self._cond held)
+    # ------------------------------------------------------------------
+
+    def _on_done(self, frame, future):
+        with self._cond:
+            key = (frame.source, frame.frame_idx)
+            del self._inflight[key]
+            self._inflight_per_source[frame.source] -= 1
+            try:
+                result = future.result()
+            except Exception as e:  # surfaced by results()
+                self._error = e
+            else:
+                self.processed[frame.source] += 1
+                heapq.heappush(self._completed, SourceResult(
+                    frame.timestamp, frame.source, frame.frame_idx, result
+                ))
+            self._cond.notify_all()
+
+    def _schedule(self, executor):
+        """
+        Submit frames round-robin, one per source per round. Sources at
+        max_inflight_per_source wait while another source has a frame
+        queued; once none has, they may use the remaining free workers.
+        """
+        submitted = 0
+        for capped in (True, False):
+            submitted += self._schedule_round_robin(executor, capped)
+        if submitted:
+            self._cond.notify_all()  # wake capture threads blocked on a full queue
+        return submitted
+
+    def _schedule_round_robin(self, executor, capped):
+        n = len(self.sources)
+        submitted = 0
+        progress = True
+        while progress and len(self._inflight) < self.workers:
+            progress = False
+            for k in range(n):
+                i = (self._rr + k) % n
+                if len(self._inflight) >= self.workers:
+                    break
+                if not self._queues[i]:
+                    continue
+                if capped and self._inflight_per_source[i] >= self.max_inflight_per_source:
+                    continue
+                frame = self._queues[i].popleft()
+                self._inflight[(i, frame.frame_idx)] = frame.timestamp
+                self._inflight_per_source[i] += 1
+                future = executor.submit(self.process, frame)
+                future.add_done_callback(
+                    lambda f, frame=frame: self._on_done(frame, f)
+                )
+                submitted += 1
+                progress = True
+            self._rr = (self._rr + 1) % n
+        return submitted
+
+    def _watermark(self):
+        """No frame stamped earlier than this can still produce a result."""
+        mark = time.monotonic()
+        for ts in self._reading_ts:
+            if ts is not None:
+                mark = min(mark, ts)
+        for q in self._queues:
+            if q:
+                mark = min(mark, q[0].timestamp)
+        for ts in self._inflight.values():
+            mark = min(mark, ts)
+        return mark
+
+    def _finished(self):
+        return (all(self._done) and not any(self._queues)
+                and not self._inflight and not self._completed)
+
+    # ------------------------------------------------------------------
+    # public API
+    # ------------------------------------------------------------------
+
+    def results(self):
+        """Yield SourceResult objects in capture-timestamp order."""
+        threads = [
+            threading.Thread(target=self._capture_loop, args=(i,), daemon=True)
+            for i in range(len(self.sources))
+        ]
+        for t in threads:
+            t.start()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                while True:
+                    with self._cond:
+                        if self._error is not None:
+                            raise self._error
+                        self._schedule(executor)
+                        mark = self._watermark()
+                        ready = []
+                        while self._completed and self._completed[0].timestamp <= mark:
+                            ready.append(heapq.heappop(self._completed))
+                        if not ready:
+                            if self._finished():
+                                break
+                            self._cond.wait(timeout=0.05)
+                    for r in ready:
+                        yield r
+        finally:
+            self.stop()
+            for t in threads:
+                t.join()
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
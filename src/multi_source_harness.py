@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+multi_source_harness.py – Local check of the MultiSourceScheduler.
+
+- Renders short synthetic clips and runs them as file sources through a
+  scheduler whose process() sleeps, so the number of frames processed
+  at once can be counted.
+- Checks that every frame comes back once, in timestamp order.
+- Checks that a pool with more workers than sources keeps all workers
+  busy, also after a short source has finished.
+- Checks that a source whose read() raises ends results() with that
+  error instead of hanging it.
+
+Usage:
+    python src/multi_source_harness.py [--keep]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from multi_source import MultiSourceScheduler
+from tracking_service_harness import check, make_test_video
+from video_io import VideoSource
+
+
+PROCESS_S = 0.02
+
+
+class _Probe:
+    """process() that sleeps and records how many calls overlap."""
+
+    def __init__(self, n_sources):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.per_source = [0] * n_sources
+        self.peak = 0
+        self.peak_per_source = [0] * n_sources
+
+    def __call__(self, frame):
+        with self.lock:
+            self.running += 1
+            self.per_source[frame.source] += 1
+            self.peak = max(self.peak, self.running)
+            self.peak_per_source[frame.source] = max(
+                self.peak_per_source[frame.source], self.per_source[frame.source])
+        time.sleep(PROCESS_S)
+        with self.lock:
+            self.running -= 1
+            self.per_source[frame.source] -= 1
+        return None
+
+
+class _FailingSource(VideoSource):
+    """A file source whose decoder fails after a few frames."""
+
+    def __init__(self, path, fail_after):
+        super().__init__(path)
+        self.fail_after = fail_after
+        self.reads = 0
+
+    def read(self, gray_out=None):
+        self.reads += 1
+        if self.reads > self.fail_after:
+            raise IOError("decoder error (simulated)")
+        return super().read(gray_out)
+
+
+def run_pool(videos, workers):
+    probe = _Probe(len(videos))
+    sched = MultiSourceScheduler(videos, probe, workers=workers)
+    results = list(sched.results())
+    stamps = [r.timestamp for r in results]
+    return probe, sched, results, stamps == sorted(stamps)
+
+
+def run(keep):
+    tmp = tempfile.mkdtemp(prefix="multi_source_")
+    long_clip = os.path.join(tmp, "long.mp4")
+    short_clip = os.path.join(tmp, "short.mp4")
+    n_long = len(make_test_video(long_clip, n_frames=60))
+    n_short = len(make_test_video(short_clip, n_frames=10))
+    results = []
+
+    for n_sources, workers in ((2, 3), (4, 7)):
+        probe, sched, res, ordered = run_pool([long_clip] * n_sources, workers)
+        results.append(check(
+            f"{workers} workers on {n_sources} sources",
+            probe.peak == workers and len(res) == n_sources * n_long and ordered,
+            f"peak {probe.peak} concurrent, {len(res)} results, "
+            f"{'ordered' if ordered else 'OUT OF ORDER'}"))
+
+    # the short source finishes early; its share must go to the long one
+    probe, sched, res, ordered = run_pool([short_clip, long_clip], 4)
+    results.append(check(
+        "free workers go to the remaining source",
+        probe.peak_per_source[1] == 4 and len(res) == n_short + n_long and ordered,
+        f"long source peak {probe.peak_per_source[1]} concurrent "
+        f"(fair share {sched.max_inflight_per_source})"))
+
+    # a failing source must end results() with its error
+    outcome = {}
+
+    def consume():
+        sched = MultiSourceScheduler(
+            [VideoSource(long_clip), _FailingSource(long_clip, fail_after=5)],
+            lambda frame: None, workers=2)
+        try:
+            for _ in sched.results():
+                pass
+            outcome["error"] = None
+        except Exception as e:
+            outcome["error"] = e
+
+    t = threading.Thread(target=consume, daemon=True)
+    t.start()
+    t.join(timeout=10)
+    results.append(check(
+        "capture error is raised, not hung on",
+        not t.is_alive() and isinstance(outcome.get("error"), IOError),
+        "hung" if t.is_alive() else repr(outcome.get("error"))))
+
+    if keep:
+        print(f"[INFO] Files kept in {tmp}")
+    else:
+        for name in os.listdir(tmp):
+            os.unlink(os.path.join(tmp, name))
+        os.rmdir(tmp)
+    return all(results)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Multi-source scheduler harness")
+    parser.add_argument("--keep", action="store_true", help="Keep temporary files")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    ok = run(args.keep)
+    print("[INFO] All checks passed." if ok else "[ERROR] Some checks failed.")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,114 +7,301 @@ This script automatically:
 - Stores the bounding box per frame
 - Converts bounding boxes to binary masks
 - Saves masks to an NPZ file usable by sam2_tracker.py
+
+Parallel mode (--jobs N, N > 1) for long clips:
+1. Fast seeding pass: the same KLT loop on every --seed-step-th frame of a
+   downscaled luma stream (--seed-scale) gives a rough box on those frames.
+2. The video is split into time chunks. Each chunk is decoded on its own
+   (by seeking) in a separate process and tracked at full resolution,
+   seeded with the fast-pass box at its first frame, grown by --seed-margin
+   px (chunk 0 uses the ROI). Every chunk runs --overlap frames into the
+   next one.
+3. Chunks are stitched inside each overlap at the frame where the two
+   trajectories agree best (highest IoU). If that IoU is below --stitch-iou
+   the chunk is tracked again, seeded from its predecessor's box.
+--verify also runs the sequential tracker and compares the two.
+
+Usage:
+    python src/prepare_masks_from_klt_bbox.py --video clip.mp4 --out masks.npz
+    python src/prepare_masks_from_klt_bbox.py --video clip.mp4 --out masks.npz \\
+        --roi 120 80 200 160 --jobs 32 [--verify]
 """
 
 import cv2
 import numpy as np
 import argparse
-from klt_tracker import ensure_upright  # reuse orientation fix
+import multiprocessing as mp
+import sys
+from video_io import VideoSource  # shared orientation-aware decoder
+from klt_tracker import (FEATURE_PARAMS, LK_PARAMS, detect_features, track_points,
+                         update_box)
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Create masks from KLT bounding boxes")
     parser.add_argument("--video", required=True, help="Input video")
     parser.add_argument("--out", required=True, help="Output npz file")
+    parser.add_argument("--roi", type=int, nargs=4, default=None,
+                        metavar=("X", "Y", "W", "H"),
+                        help="Initial ROI on the upright first frame (skips the GUI)")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Worker processes; > 1 enables chunk-parallel tracking")
+    parser.add_argument("--overlap", type=int, default=30,
+                        help="Frames each chunk runs into the next one for stitching")
+    parser.add_argument("--seed-scale", type=float, default=0.25,
+                        help="Resolution scale of the fast seeding pass")
+    parser.add_argument("--seed-step", type=int, default=4,
+                        help="Seeding pass tracks every N-th frame only")
+    parser.add_argument("--seed-margin", type=float, default=8,
+                        help="Pixels added around a chunk's seed box for feature detection")
+    parser.add_argument("--stitch-iou", type=float, default=0.8,
+                        help="Re-track a chunk whose overlap IoU stays below this")
+    parser.add_argument("--verify", action="store_true",
+                        help="Also run sequentially and compare (exit 1 if off)")
     return parser.parse_args()
 
 
-def main():
-    args = parse_args()
-    cap = cv2.VideoCapture(args.video)
+def track_boxes(cap, bbox, max_frames=None, feature_params=FEATURE_PARAMS,
+                lk_params=LK_PARAMS):
+    """
+    KLT bounding box for every frame from the source's current position.
+
+    bbox (native coordinates of cap's gray frames) seeds the features in the
+    first frame read. Returns an (N, 4) float32 array.
+    """
+    boxes = []
+    old_gray = None
+    # ping-pong gray buffers: decode into next_gray, swap after tracking
+    next_gray = cap.new_gray_buffer()
+
+    while max_frames is None or len(boxes) < max_frames:
+        ret, _, frame_gray = cap.read(gray_out=next_gray)
+        if not ret:
+            break
+
+        if old_gray is None:
+            old_gray = frame_gray.copy()
+            p0 = detect_features(old_gray, bbox, feature_params)
+
+        good_new = track_points(old_gray, frame_gray, p0, lk_params)
+
+        if len(good_new) >= 4:
+            x_min = int(good_new[:,0].min())
+            y_min = int(good_new[:,1].min())
+            x_max = int(good_new[:,0].max())
+            y_max = int(good_new[:,1].max())
+            bbox = np.array([x_min, y_min, x_max, y_max], dtype=np.float32)
 
+        boxes.append(bbox)
+
+        old_gray, next_gray = next_gray, old_gray
+        p0 = good_new.reshape(-1,1,2) if len(good_new)>0 else np.zeros((0,1,2),dtype=np.float32)
+
+    return np.array(boxes, dtype=np.float32).reshape(-1, 4)
+
+
+def box_iou(a, b):
+    """IoU of (N, 4) box arrays, row by row."""
+    iw = np.clip(np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]), 0, None)
+    ih = np.clip(np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1]), 0, None)
+    inter = iw * ih
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a + area_b - inter, 1e-6)
+
+
+def _init_worker():
+    # one process per core already; keep cv2 from oversubscribing
+    cv2.setNumThreads(1)
+
+
+def _grow(box, margin):
+    return np.asarray(box, dtype=np.float32) + np.array(
+        [-margin, -margin, margin, margin], dtype=np.float32)
+
+
+def _track_chunk(task):
+    video, start, n_frames, seed_box, margin = task
+    cap = VideoSource(video, gray_only=True, start_frame=start)
     if not cap.isOpened():
-        print("[ERROR] Cannot open video.")
-        return
+        return np.zeros((0, 4), dtype=np.float32)
+    # features are re-detected here; searching a slightly larger box keeps
+    # the points (and so the box) from shrinking at every chunk start
+    seed = np.clip(_grow(seed_box, margin), 0,
+                   [cap.native_w, cap.native_h, cap.native_w, cap.native_h])
+    boxes = track_boxes(cap, seed, max_frames=n_frames)
+    cap.release()
+    return boxes
 
-    # read first frame for ROI selection
-    ret, frame = cap.read()
-    if not ret:
-        print("[ERROR] Empty video.")
-        return
 
-    frame = ensure_upright(frame)
-    old_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    H, W = frame.shape[:2]
+def seed_pass(video, bbox, box0, scale, step):
+    """
+    Fast pass on every step-th frame at low resolution.
 
-    # select ROI
-    cv2.namedWindow("Select ROI", cv2.WINDOW_NORMAL)
-    cv2.resizeWindow("Select ROI", W, H)
-    print("[INFO] Select initial ROI for KLT.")
-    roi = cv2.selectROI("Select ROI", frame, showCrosshair=True)
-    cv2.destroyWindow("Select ROI")
+    Returns (frame indices, boxes) of the sampled frames. Box centers follow
+    the low-resolution track; sizes are box0 (the full-resolution box of the
+    first frame) scaled by the relative size change of the low-resolution
+    box, since boxes found at low resolution come out systematically small.
+    """
+    cap = VideoSource(video, gray_only=True, scale=scale, step=step)
+    sx = cap.gray_size[0] / cap.native_w
+    sy = cap.gray_size[1] / cap.native_h
+    s = np.array([sx, sy, sx, sy], dtype=np.float32)
+    # shrink the feature spacing with the image
+    min_distance = max(1, int(FEATURE_PARAMS["minDistance"] * sx))
+    feature_params = dict(FEATURE_PARAMS, minDistance=min_distance)
+    boxes = track_boxes(cap, bbox * s, feature_params=feature_params) / s
+    cap.release()
 
-    x, y, w, h = roi
-    if w == 0 or h == 0:
-        print("[ERROR] Empty ROI.")
-        return
+    size = boxes[:, 2:] - boxes[:, :2]
+    center = 0.5 * (boxes[:, 2:] + boxes[:, :2])
+    half = 0.5 * (box0[2:] - box0[:2]) * size / np.maximum(size[:1], 1e-6)
+    frames = np.arange(len(boxes)) * step
+    return frames, np.hstack([center - half, center + half]).astype(np.float32)
 
-    # initialize bounding box
-    bbox = np.array([x, y, x+w, y+h], dtype=np.float32)
 
-    # detect features inside ROI
-    mask = np.zeros_like(old_gray)
-    mask[y:y+h, x:x+w] = 255
+def seed_at(frames, seeds, frame_idx):
+    """Seed box at any frame, interpolated between the sampled frames."""
+    return np.array([np.interp(frame_idx, frames, seeds[:, k]) for k in range(4)],
+                    dtype=np.float32)
 
-    p0 = cv2.goodFeaturesToTrack(
-        old_gray, mask=mask, maxCorners=400, qualityLevel=0.001,
-        minDistance=4, blockSize=5
-    )
-    if p0 is None:
-        p0 = np.zeros((0,1,2), dtype=np.float32)
 
-    # LK params
-    lk_params = dict(
-        winSize=(21,21),
-        maxLevel=3,
-        criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01)
-    )
+def first_box(cap, bbox):
+    """The box track_boxes reports for the first frame (full resolution)."""
+    gray = cv2.cvtColor(cap.first_frame, cv2.COLOR_BGR2GRAY)
+    p0 = detect_features(gray, bbox).reshape(-1, 2)
+    return update_box(p0, np.asarray(bbox, dtype=np.float32))
 
-    # rewind video
-    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
 
-    masks = []
+def track_parallel(video, bbox, box0, n_est, args):
+    frames, seeds = seed_pass(video, bbox, box0, args.seed_scale, args.seed_step)
+    n_total = max(n_est, int(frames[-1]) + 1)
+    print(f"[INFO] Seeding pass done: {len(frames)} sampled frames "
+          f"(every {args.seed_step}), ~{n_total} frames.")
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
+    jobs, overlap = args.jobs, args.overlap
+    n_chunks = max(1, min(jobs, n_total // max(2 * overlap, 1)))
+    starts = [round(i * n_total / n_chunks) for i in range(n_chunks)]
+    tasks = []
+    for c, start in enumerate(starts):
+        seed = bbox if c == 0 else seed_at(frames, seeds, start)
+        # the last chunk reads to the end (frame counts can be inexact)
+        n = starts[c + 1] + overlap - start if c + 1 < n_chunks else None
+        # chunk 0 starts from the ROI exactly like the sequential run
+        tasks.append((video, start, n, seed, args.seed_margin if c else 0))
 
-        frame = ensure_upright(frame)
-        frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    print(f"[INFO] Tracking {n_chunks} chunks on {jobs} processes.")
+    with mp.Pool(jobs, initializer=_init_worker) as pool:
+        chunks = pool.map(_track_chunk, tasks)
 
-        if len(p0) > 0:
-            p1, st, err = cv2.calcOpticalFlowPyrLK(old_gray, frame_gray, p0, None, **lk_params)
-            if p1 is not None and st is not None:
-                st = st.reshape(-1)
-                good_new = p1[st==1]
-            else:
-                good_new = np.zeros((0,2), dtype=np.float32)
-        else:
-            good_new = np.zeros((0,2), dtype=np.float32)
+    # Stitch: inside each overlap, switch to the next chunk where they agree
+    # best. A chunk that never gets within --stitch-iou of its predecessor
+    # started from a bad seed: track it again from the predecessor's box.
+    parts = []
+    prev = _pad_boxes(chunks[0], tasks[0][2] or 0, bbox)
+    pos = 0
+    for c in range(1, n_chunks):
+        off = starts[c] - starts[c - 1]
+        tail = prev[off:]
+        ov = len(tail)
+        chunk = chunks[c]
+        iou = box_iou(tail, _pad_boxes(chunk, ov, tasks[c][3])[:ov]) if ov else np.zeros(0)
+        if ov == 0 or iou.max() < args.stitch_iou:
+            seed = prev[off] if ov else prev[-1]
+            print(f"[WARN] Chunk {c}: overlap IoU {iou.max() if ov else 0:.3f} "
+                  f"< {args.stitch_iou}, re-tracking from chunk {c - 1}.")
+            chunk = _track_chunk(tasks[c][:3] + (seed, args.seed_margin))
+            iou = box_iou(tail, _pad_boxes(chunk, ov, seed)[:ov]) if ov else np.zeros(0)
+        switch = int(np.argmax(iou)) if ov else 0
+        print(f"[INFO] Chunk {c - 1}->{c}: switch at frame {starts[c] + switch}, "
+              f"IoU {iou[switch] if ov else 0:.3f}")
+        parts.append(prev[pos:off + switch])
+        pos = switch
+        prev = _pad_boxes(chunk, (tasks[c][2] or 0), prev[-1])
+    parts.append(prev[pos:])
 
-        good_new = np.array(good_new).reshape(-1,2)
+    # frame counts from the container can be too high: end where a chunk ran
+    # out of frames early
+    end = starts[-1] + len(chunks[-1])
+    for c in range(n_chunks - 1):
+        if len(chunks[c]) < tasks[c][2]:
+            end = min(end, starts[c] + len(chunks[c]))
+    return np.vstack(parts)[:end]
 
-        if len(good_new) >= 4:
-            x_min = int(good_new[:,0].min())
-            y_min = int(good_new[:,1].min())
-            x_max = int(good_new[:,0].max())
-            y_max = int(good_new[:,1].max())
-            bbox = np.array([x_min, y_min, x_max, y_max], dtype=np.float32)
 
-        # build mask for this frame
-        m = np.zeros((H,W), dtype=np.uint8)
-        x1,y1,x2,y2 = bbox.astype(int)
-        m[y1:y2, x1:x2] = 1
-        masks.append(m)
+def _pad_boxes(chunk, n, seed):
+    """Pad a chunk that came back short (e.g. a seek past EOF) with its last box."""
+    if len(chunk) >= n:
+        return chunk
+    fill = chunk[-1] if len(chunk) else np.asarray(seed, dtype=np.float32)
+    return np.vstack([chunk, np.tile(fill, (n - len(chunk), 1))])
 
-        old_gray = frame_gray.copy()
-        p0 = good_new.reshape(-1,1,2) if len(good_new)>0 else np.zeros((0,1,2),dtype=np.float32)
 
-    masks = np.stack(masks, axis=0)
+def verify(boxes, reference, tolerance):
+    """Compare with the sequential boxes; True if the mean IoU is within tolerance."""
+    n = min(len(boxes), len(reference))
+    iou = box_iou(boxes[:n], reference[:n])
+    ok = len(boxes) == len(reference) and iou.mean() >= tolerance
+    print(f"[{'INFO' if ok else 'ERROR'}] Parallel vs sequential: {len(boxes)} / "
+          f"{len(reference)} frames, IoU mean {iou.mean():.3f}, min {iou.min():.3f} "
+          f"(frame {int(np.argmin(iou))}), tolerance {tolerance}")
+    return ok
+
+
+def main():
+    args = parse_args()
+    # headless: decode luma only (FFmpeg gray pipe when available)
+    cap = VideoSource(args.video, gray_only=True)
+
+    if not cap.isOpened():
+        print("[ERROR] Cannot open video / empty video.")
+        return
+
+    # first frame (kept in color by VideoSource) for ROI selection
+    frame = cap.upright(cap.first_frame)
+    H, W = frame.shape[:2]
+
+    if args.roi is not None:
+        roi = args.roi
+    else:
+        # select ROI
+        cv2.namedWindow("Select ROI", cv2.WINDOW_NORMAL)
+        cv2.resizeWindow("Select ROI", W, H)
+        print("[INFO] Select initial ROI for KLT.")
+        roi = cv2.selectROI("Select ROI", frame, showCrosshair=True)
+        cv2.destroyWindow("Select ROI")
+
+    x, y, w, h = roi
+    if w == 0 or h == 0:
+        print("[ERROR] Empty ROI.")
+        return
+
+    # initialize bounding box (tracking runs in native orientation)
+    bbox = cap.to_native_box(np.array([x, y, x+w, y+h], dtype=np.float32))
+
+    if args.jobs > 1:
+        box0 = first_box(cap, bbox)
+        n_est = cap.frame_count
+        cap.release()
+        boxes = track_parallel(args.video, bbox, box0, n_est, args)
+        if args.verify:
+            print("[INFO] --verify: running the sequential tracker.")
+            ref_cap = VideoSource(args.video, gray_only=True)
+            reference = track_boxes(ref_cap, bbox)
+            ref_cap.release()
+            if not verify(boxes, reference, args.stitch_iou):
+                sys.exit(1)
+    else:
+        # VideoSource starts again at frame 0 (no rewind needed)
+        boxes = track_boxes(cap, bbox)
+        cap.release()
+
+    # build one mask per frame (masks are stored upright)
+    masks = np.zeros((len(boxes), H, W), dtype=np.uint8)
+    for m, box in zip(masks, boxes):
+        x1,y1,x2,y2 = cap.to_upright_box(box).astype(int)
+        m[y1:y2, x1:x2] = 1
+
     print("[INFO] saving masks:", masks.shape)
     np.savez_compressed(args.out, masks=masks)
     print("[INFO] saved to", args.out)
@@ -18,12 +18,7 @@ import numpy as np
 import argparse
 import os
 
-
-def ensure_upright(frame):
-    h, w = frame.shape[:2]
-    if h > w:
-        frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
-    return frame
+from video_io import VideoSource
 
 
 def parse_args():
@@ -43,20 +38,19 @@ def main():
 
     os.makedirs(os.path.dirname(args.out), exist_ok=True)
 
-    cap = cv2.VideoCapture(args.video)
+    # Frames after the first are only counted, so decode luma only
+    cap = VideoSource(args.video, gray_only=True)
     if not cap.isOpened():
         print("[ERROR] Could not open video.")
         return
 
-    # Read first frame to define ROI and size
-    ret, frame = cap.read()
-    if not ret:
-        print("[ERROR] Could not read first frame.")
-        return
-
-    frame = ensure_upright(frame)
+    # First frame (decoded when the source was opened) defines ROI and size
+    frame = cap.upright(cap.first_frame)
     H, W = frame.shape[:2]
 
+    # Skip the first frame in the stream, it is counted below
+    cap.read()
+
     # Let user select ROI on first frame
     cv2.namedWindow("Select ROI (SAM2 offline)", cv2.WINDOW_NORMAL)
     cv2.resizeWindow("Select ROI (SAM2 offline)", W, H)
@@ -69,30 +63,20 @@ def main():
         print("[ERROR] Empty ROI selected.")
         return
 
-    # Pre-allocate masks list
-    masks = []
-
-    # First frame mask
-    mask0 = np.zeros((H, W), dtype=np.uint8)
-    mask0[y:y + h, x:x + w] = 1
-    masks.append(mask0)
-
-    # Process remaining frames
+    # Count the remaining frames (the first one was read above); every
+    # mask is the same ROI, so nothing is allocated per frame
     frame_idx = 1
     while True:
-        ret, frame = cap.read()
+        ret, _, _ = cap.read()
         if not ret:
             break
-        frame = ensure_upright(frame)
-        # For now, just reuse the same ROI location as mask
-        mask = np.zeros((H, W), dtype=np.uint8)
-        mask[y:y + h, x:x + w] = 1
-        masks.append(mask)
         frame_idx += 1
 
     cap.release()
 
-    masks = np.stack(masks, axis=0)  # (N, H, W)
+    # For now, just reuse the same ROI location as mask
+    masks = np.zeros((frame_idx, H, W), dtype=np.uint8)  # (N, H, W)
+    masks[:, y:y + h, x:x + w] = 1
     print(f"[INFO] Created masks array with shape: {masks.shape}")
 
     np.savez_compressed(args.out, masks=masks)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+quality_controller.py – Trade tracking quality for speed to hold a frame rate.
+
+The trackers describe their tunable knobs as a ladder of Quality levels,
+best first (KLT_LEVELS, ARUCO_LEVELS). QualityController watches the
+measured per-frame latency against a budget (1 / target fps) and moves
+along the ladder:
+
+- smoothed latency (EMA) above the budget for `degrade_after` frames in a
+  row -> one level cheaper
+- smoothed latency below `recover_ratio` * budget for `recover_after`
+  frames in a row -> one level better
+
+The gap between the two thresholds and the longer recovery wait are the
+hysteresis. If a recovery has to be undone shortly after, the wait before
+the next recovery doubles, so a level that cannot be sustained is not
+retried every second.
+
+QualityLog writes the chosen settings for every frame to a CSV file.
+"""
+
+import csv
+from collections import namedtuple
+
+
+# max_corners / win_size / max_level: KLT (goodFeaturesToTrack / LK)
+# scale: processing resolution relative to the decoded gray frame
+# detect_every: ArUco detection rate (Kalman prediction in between)
+Quality = namedtuple("Quality", "max_corners win_size max_level scale detect_every")
+
+KLT_LEVELS = [
+    Quality(400, 21, 3, 1.0, 1),    # klt_tracker defaults
+    Quality(300, 21, 3, 1.0, 1),
+    Quality(200, 15, 2, 1.0, 1),
+    Quality(150, 15, 2, 0.75, 1),
+    Quality(100, 11, 2, 0.5, 1),
+    Quality(60, 9, 1, 0.5, 1),
+]
+
+ARUCO_LEVELS = [
+    Quality(0, 0, 0, 1.0, 1),       # aruco_tracker defaults
+    Quality(0, 0, 0, 1.0, 2),
+    Quality(0, 0, 0, 0.75, 2),
+    Quality(0, 0, 0, 0.75, 3),
+    Quality(0, 0, 0, 0.5, 4),
+]
+
+
+class QualityController:
+    def __init__(self, levels, target_fps, recover_ratio=0.7, smoothing=0.2,
+                 degrade_after=5, recover_after=30, max_backoff=8):
+        self.levels = levels
+        self.budget = 1.0 / target_fps
+        self.recover_ratio = recover_ratio
+        self.smoothing = smoothing
+        self.degrade_after = degrade_after
+        self.recover_after = recover_after
+        self.max_backoff = max_backoff
+
+        self.level = 0
+        self.ema = None
+        self.changes = 0
+        self._over = 0
+        self._under = 0
+        self._backoff = 1
+        self._since_recover = None  # frames since the last recovery
+
+    @property
+    def settings(self):
+        return self.levels[self.level]
+
+    def update(self, latency):
+        """
+        Feed the latency (seconds) of the frame just finished.
+        Returns True if the level changed (read .settings for the new one).
+        """
+        if self.ema is None:
+            self.ema = latency
+        else:
+            self.ema += self.smoothing * (latency - self.ema)
+        if self._since_recover is not None:
+            self._since_recover += 1
+
+        if self.ema > self.budget:
+            self._over += 1
+            self._under = 0
+        elif self.ema < self.recover_ratio * self.budget:
+            self._under += 1
+            self._over = 0
+        else:
+            self._over = self._under = 0
+
+        if self._over >= self.degrade_after and self.level < len(self.levels) - 1:
+            recent = (self._since_recover is not None
+                      and self._since_recover < self.recover_after * self._backoff)
+            self._backoff = min(self._backoff * 2, self.max_backoff) if recent else 1
+            self._since_recover = None
+            self._set_level(self.level + 1)
+            return True
+
+        if self._under >= self.recover_after * self._backoff and self.level > 0:
+            self._since_recover = 0
+            self._set_level(self.level - 1)
+            return True
+        return False
+
+    def _set_level(self, level):
+        self.level = level
+        self.changes += 1
+        # measure the new settings from scratch
+        self.ema = None
+        self._over = self._under = 0
+
+    def summary(self):
+        return (f"level {self.level}/{len(self.levels) - 1} {self.settings}, "
+                f"{self.changes} changes, budget {self.budget * 1000:.1f} ms")
+
+
+class QualityLog:
+    """
+    Per-frame CSV: frame, latency_ms, ema_ms, level and the Quality fields.
+    Write each frame before controller.update(), so the row holds the settings
+    the frame ran with and the smoothed latency of the frames before it.
+    """
+
+    def __init__(self, path):
+        self._f = open(path, "w", newline="")
+        self._w = csv.writer(self._f)
+        self._w.writerow(["frame", "latency_ms", "ema_ms", "level"] + list(Quality._fields))
+
+    def write(self, frame_idx, latency, controller):
+        self._w.writerow([frame_idx, f"{latency * 1000:.3f}",
+                          f"{controller.ema * 1000:.3f}" if controller.ema is not None else "",
+                          controller.level] + list(controller.settings))
+
+    def close(self):
+        self._f.close()
@@ -8,6 +8,9 @@ Real-time-like tracker that uses precomputed segmentation masks
 - Video is read frame-by-frame.
 - For each frame, a mask is loaded from the masks array.
 - A bounding box and overlay are drawn on the frame.
+- All per-frame images (binary mask, blend, output) live in buffers that
+  are allocated once (MaskOverlay), so the steady-state loop (MaskPlayback)
+  does not allocate full-frame arrays.
 
 Usage:
     python src/sam2_tracker.py --video data/videos/klt_demo.mp4 --masks data/sam2_masks/klt_demo_masks.npz
@@ -19,18 +22,132 @@ import cv2
 import numpy as np
 import argparse
 
+from video_io import VideoSource
+from trajectory_store import TrajectoryWriter
+
+
+class MaskOverlay:
+    """Preallocated buffers for the per-frame mask bbox and overlay."""
+
+    def __init__(self, H, W, alpha=0.4, color=(0, 255, 0)):
+        self.shape = (H, W)
+        self.alpha = alpha
+        self.solid = np.empty((H, W, 3), dtype=np.uint8)
+        self.solid[:] = color
+        self.mask_bin = np.empty((H, W), dtype=np.uint8)
+        self.resized = np.empty((H, W), dtype=np.uint8)
+        self.fallback = np.empty((H, W), dtype=np.uint8)
+        self.blend = np.empty((H, W, 3), dtype=np.uint8)
+        self.vis = np.empty((H, W, 3), dtype=np.uint8)
+
+    def box_mask(self, bbox):
+        """Mask with only bbox (inclusive corners) set, in the reused fallback buffer."""
+        self.fallback.fill(0)
+        if bbox is not None:
+            x1, y1, x2, y2 = bbox
+            self.fallback[y1:y2 + 1, x1:x2 + 1] = 1
+        return self.fallback
+
+    def set_mask(self, mask):
+        """Binarize mask; returns its (x_min, y_min, x_max, y_max) or None."""
+        if mask.dtype == bool:
+            mask = mask.view(np.uint8)
+        if mask.shape != self.shape:
+            H, W = self.shape
+            print(f"[WARN] Mask shape {mask.shape} does not match frame {H,W}. Resizing mask.")
+            cv2.resize(mask, (W, H), dst=self.resized, interpolation=cv2.INTER_NEAREST)
+            mask = self.resized
+
+        # Binary mask in {0,255}
+        cv2.compare(mask, 0, cv2.CMP_GT, dst=self.mask_bin)
+
+        # Bounding box of the foreground pixels
+        x, y, w, h = cv2.boundingRect(self.mask_bin)
+        if w == 0 or h == 0:
+            return None
+        return (x, y, x + w - 1, y + h - 1)
+
+    def render(self, frame):
+        """Blend the green mask over frame into the reused vis buffer."""
+        # alpha * color + (1 - alpha) * frame, copied in under the mask only
+        np.copyto(self.vis, frame)
+        cv2.addWeighted(self.solid, self.alpha, frame, 1 - self.alpha, 0,
+                        dst=self.blend)
+        cv2.copyTo(self.blend, self.mask_bin, self.vis)
+        return self.vis
+
+
+class MaskPlayback:
+    """
+    The steady-state playback loop; step() handles one frame.
+
+    After step(): vis (upright frame with overlay and box), bbox (last box,
+    carried over when the mask is empty), fresh (bbox comes from this
+    frame's mask) and frame_idx describe the frame.
+    """
+
+    def __init__(self, cap, masks):
+        self.cap = cap
+        self.masks = masks
+        self.painter = MaskOverlay(cap.height, cap.width)
+        self.frame_idx = -1
+        self.bbox = None
+        self.fresh = False
+        self.vis = None
+
+    def step(self):
+        """Render the next frame; False at the end of the video."""
+        ret, frame, _ = self.cap.read()
+        if not ret:
+            return False
+        self.frame_idx += 1
+        frame = self.cap.upright(frame)
+        painter = self.painter
+
+        # Select corresponding mask index (clamp if video longer than masks)
+        have_mask = self.frame_idx < self.masks.shape[0]
+        if have_mask:
+            mask = self.masks[self.frame_idx]
+        else:
+            # If we have no mask for this frame, reuse last
+            mask = painter.box_mask(self.bbox)
 
-def ensure_upright(frame):
-    h, w = frame.shape[:2]
-    if h > w:
-        frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)
-    return frame
+        # Binarize (resizing if the shape does not match the frame after
+        # rotation) and compute the bounding box of the foreground pixels
+        bbox = painter.set_mask(mask)
+        # a box drawn from the fallback mask is carried over, not fresh
+        self.fresh = have_mask and bbox is not None
+        if self.fresh:
+            self.bbox = bbox
+        # If no nonzero pixels and we have a last bbox, keep drawing that
+
+        # Green overlay for mask, blended with the original frame
+        vis = painter.render(frame)
+
+        # Draw bounding box if available
+        if self.bbox is not None:
+            x1, y1, x2, y2 = self.bbox
+            cv2.rectangle(vis, (x1, y1), (x2, y2), (0, 0, 255), 2)
+            cv2.putText(
+                vis,
+                "SAM2 object",
+                (x1, max(y1 - 10, 0)),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.7,
+                (0, 0, 255),
+                2,
+                cv2.LINE_AA
+            )
+        self.vis = vis
+        return True
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description="SAM2 segmentation-based tracker")
     parser.add_argument("--video", required=True, help="Path to input video")
     parser.add_argument("--masks", required=True, help="Path to npz file with masks")
+    parser.add_argument("--traj", default=None,
+                        help="Optional .traj file to record the object trajectory")
     return parser.parse_args()
 
 
@@ -44,102 +161,50 @@ def main():
         return
 
     masks = data["masks"]  # (N, H, W), uint8 or bool
-    N_masks = masks.shape[0]
     print(f"[INFO] Loaded masks with shape: {masks.shape}")
 
-    # Open video
-    cap = cv2.VideoCapture(args.video)
+    # Open video (masks are stored upright, so only the color frame is needed)
+    cap = VideoSource(args.video, need_gray=False)
     if not cap.isOpened():
         print("[ERROR] Could not open video.")
         return
 
-    # Get first frame to size the window
-    ret, frame = cap.read()
-    if not ret:
-        print("[ERROR] Could not read first frame.")
-        return
-
-    frame = ensure_upright(frame)
-    H, W = frame.shape[:2]
+    H, W = cap.height, cap.width
 
     cv2.namedWindow("SAM2 Tracker", cv2.WINDOW_NORMAL)
     cv2.resizeWindow("SAM2 Tracker", W, H)
 
-    print("[INFO] Starting SAM2-based tracking. Press 'q' to quit.")
-
-    frame_idx = 0
-    last_bbox = None
+    traj = None
+    if args.traj:
+        traj = TrajectoryWriter(args.traj, meta={
+            "tracker": "sam2", "video": args.video, "masks": args.masks,
+            "fps": cap.fps, "width": W, "height": H,
+        })
 
-    # Rewind video to first frame (we already read one)
-    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    print("[INFO] Starting SAM2-based tracking. Press 'q' to quit.")
 
+    playback = MaskPlayback(cap, masks)
     while True:
-        ret, frame = cap.read()
-        if not ret:
+        if not playback.step():
             print("[INFO] End of video.")
             break
 
-        frame = ensure_upright(frame)
-
-        # Select corresponding mask index (clamp if video longer than masks)
-        if frame_idx < N_masks:
-            mask = masks[frame_idx]
-        else:
-            # If we have no mask for this frame, reuse last
-            if last_bbox is None:
-                mask = np.zeros((H, W), dtype=np.uint8)
-            else:
-                mask = np.zeros((H, W), dtype=np.uint8)
-                x1, y1, x2, y2 = last_bbox
-                mask[y1:y2, x1:x2] = 1
-
-        # Ensure mask shape matches frame after rotation
-        if mask.shape != (H, W):
-            print(f"[WARN] Mask shape {mask.shape} does not match frame {H,W}. Resizing mask.")
-            mask = cv2.resize(mask.astype(np.uint8), (W, H), interpolation=cv2.INTER_NEAREST)
-
-        # Binary mask in {0,1}
-        mask_bin = (mask > 0).astype(np.uint8)
-
-        # Compute bounding box from mask, if any pixels are foreground
-        ys, xs = np.where(mask_bin == 1)
-        if len(xs) > 0 and len(ys) > 0:
-            x_min, x_max = int(xs.min()), int(xs.max())
-            y_min, y_max = int(ys.min()), int(ys.max())
-            last_bbox = (x_min, y_min, x_max, y_max)
-        # If no nonzero pixels and we have a last_bbox, keep drawing that
-
-        # Create colored overlay for mask
-        overlay = frame.copy()
-        overlay[mask_bin == 1] = (0, 255, 0)  # green overlay for mask
-
-        # Blend overlay with original frame
-        alpha = 0.4
-        vis = cv2.addWeighted(overlay, alpha, frame, 1 - alpha, 0)
-
-        # Draw bounding box if available
-        if last_bbox is not None:
-            x1, y1, x2, y2 = last_bbox
-            cv2.rectangle(vis, (x1, y1), (x2, y2), (0, 0, 255), 2)
-            cv2.putText(
-                vis,
-                "SAM2 object",
-                (x1, max(y1 - 10, 0)),
-                cv2.FONT_HERSHEY_SIMPLEX,
-                0.7,
-                (0, 0, 255),
-                2,
-                cv2.LINE_AA
-            )
+        frame_idx = playback.frame_idx
+        if traj is not None and playback.bbox is not None:
+            # confidence 0 marks a bbox carried over from an earlier mask
+            traj.append(frame_idx, cap.frame_time(frame_idx), 0, playback.bbox,
+                        confidence=1.0 if playback.fresh else 0.0)
 
-        cv2.imshow("SAM2 Tracker", vis)
+        cv2.imshow("SAM2 Tracker", playback.vis)
 
         key = cv2.waitKey(1) & 0xFF
         if key == ord("q"):
             print("[INFO] 'q' pressed. Exiting.")
             break
 
-        frame_idx += 1
+    if traj is not None:
+        traj.close()
+        print(f"[INFO] Trajectory saved to {args.traj}")
 
     cap.release()
     cv2.destroyAllWindows()
@@ -0,0 +1,639 @@
+#!/usr/bin/env python3
+"""
+tracking_service.py – Local tracking daemon with a warm worker pool.
+
+Launching a tracker script costs a fresh interpreter, cv2 import and
+ArucoDetector construction every time. This daemon keeps N worker
+processes alive with all of that already done, and serves two kinds of
+requests over a Unix socket (or localhost TCP):
+
+- jobs:     a video path + tracker type + options; per-frame results are
+            streamed back until {"done": true}.
+- sessions: open a tracker once, then submit gray frames one at a time.
+            Tracker state (KLT points, SAM2 mask index, ...) stays in the
+            worker that owns the session.
+
+Jobs and sessions run on separate workers (--job-workers), so a long job
+never delays session frames. A worker process that dies is restarted; the
+request that hit it, and later frames of its sessions, get an error.
+
+Wire format: one JSON header per line; a header with "nbytes" is followed
+by that many raw bytes (a uint8 gray frame of the given "shape").
+
+Usage:
+    python src/tracking_service.py serve --workers 4
+    python src/tracking_service.py job --video data/videos/aruco_demo.mp4 --tracker aruco
+
+From Python:
+    from tracking_service import TrackingClient
+    with TrackingClient() as client:
+        for res in client.run_job("clip.mp4", "klt", roi=[x, y, w, h]):
+            ...
+        session = client.open_session("aruco")
+        res = session.track(gray)
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import queue
+import socket
+import socketserver
+import threading
+import uuid
+
+import cv2
+import numpy as np
+
+from aruco_tracker import make_detector
+from klt_tracker import detect_features, track_points, update_box
+from video_io import VideoSource
+
+
+DEFAULT_SOCKET = "/tmp/cv_tracking.sock"
+TRACKERS = ("aruco", "klt", "sam2")
+
+
+class TrackingServiceError(RuntimeError):
+    """Error reported by the tracking service for a request."""
+
+
+# ----------------------------------------------------------------------
+# wire protocol
+# ----------------------------------------------------------------------
+
+def parse_address(address):
+    """'host:port' -> TCP (host, port); anything else is a Unix socket path."""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and "/" not in address:
+        return (host or "127.0.0.1", int(port))
+    return address
+
+
+def send_msg(sock, header, payload=None):
+    if payload is not None:
+        payload = np.ascontiguousarray(payload)
+        header = dict(header, nbytes=payload.nbytes, shape=list(payload.shape))
+    sock.sendall((json.dumps(header) + "\n").encode("utf-8"))
+    if payload is not None:
+        sock.sendall(memoryview(payload).cast("B"))
+
+
+def recv_msg(rfile):
+    """Return (header, payload) or (None, None) when the peer closed."""
+    line = rfile.readline()
+    if not line:
+        return None, None
+    header = json.loads(line)
+    payload = None
+    n = header.get("nbytes", 0)
+    if n:
+        raw = rfile.read(n)
+        if len(raw) != n:
+            return None, None
+        payload = np.frombuffer(raw, dtype=np.uint8).reshape(header["shape"])
+    return header, payload
+
+
+# ----------------------------------------------------------------------
+# tracker sessions (live inside worker processes)
+# ----------------------------------------------------------------------
+
+class _Identity:
+    """Coordinate mapping for frames submitted by clients (no rotation)."""
+
+    def to_upright_points(self, pts):
+        return pts
+
+    def to_upright_box(self, box):
+        return box
+
+    def to_native_box(self, box):
+        return box
+
+
+class ArucoSession:
+    def __init__(self, options, detector):
+        self.detector = detector
+
+    def step(self, gray, src):
+        corners, ids, _ = self.detector.detectMarkers(gray)
+        markers = []
+        if ids is not None:
+            for pts, marker_id in zip(corners, ids):
+                pts = src.to_upright_points(pts[0])
+                markers.append({
+                    "id": int(marker_id),
+                    "corners": pts.tolist(),
+                    "center": [float(pts[:, 0].mean()), float(pts[:, 1].mean())],
+                })
+        return {"markers": markers}
+
+
+class KLTSession:
+    """KLT ROI tracker; the first frame seeds features inside options["roi"]."""
+
+    def __init__(self, options, detector=None):
+        if "roi" not in options:
+            raise ValueError("klt tracker needs options.roi = [x, y, w, h]")
+        x, y, w, h = options["roi"]
+        self.roi_box = np.array([x, y, x + w, y + h], dtype=np.float32)
+        self.old_gray = None
+        self.p0 = None
+        self.box = None
+
+    def step(self, gray, src):
+        if self.old_gray is None:
+            self.box = src.to_native_box(self.roi_box)
+            self.p0 = detect_features(gray, self.box)
+            good_new = self.p0.reshape(-1, 2)
+        else:
+            good_new = track_points(self.old_gray, gray, self.p0)
+            self.box = update_box(good_new, self.box)
+            self.p0 = good_new.reshape(-1, 1, 2)
+        self.old_gray = gray.copy()
+        return {
+            "box": [float(v) for v in src.to_upright_box(self.box)],
+            "points": int(good_new.shape[0]),
+        }
+
+
+class SAM2Session:
+    """Plays back precomputed (upright) masks, one per submitted frame."""
+
+    def __init__(self, options, detector=None):
+        if "masks" not in options:
+            raise ValueError("sam2 tracker needs options.masks = path to .npz")
+        data = np.load(options["masks"])
+        if "masks" not in data:
+            raise ValueError("NPZ file must contain array 'masks'.")
+        self.masks = data["masks"]
+        self.frame_idx = 0
+        self.last_bbox = None
+
+    def step(self, gray, src):
+        if self.frame_idx < self.masks.shape[0]:
+            ys, xs = np.nonzero(self.masks[self.frame_idx])
+            if len(xs) > 0:
+                self.last_bbox = [int(xs.min()), int(ys.min()),
+                                  int(xs.max()), int(ys.max())]
+        self.frame_idx += 1
+        return {"box": self.last_bbox}
+
+
+SESSION_TYPES = {"aruco": ArucoSession, "klt": KLTSession, "sam2": SAM2Session}
+
+
+def _warm_up():
+    """Exercise the cv2 code paths once, before any request."""
+    detector = make_detector()
+    blank = np.zeros((480, 640), dtype=np.uint8)
+    cv2.rectangle(blank, (200, 150), (440, 330), 255, -1)
+    detector.detectMarkers(blank)
+    p0 = detect_features(blank, (180, 130, 460, 350))
+    track_points(blank, blank, p0)
+    return detector
+
+
+def _worker_main(conn):
+    detector = _warm_up()
+    conn.send({"ready": True, "pid": os.getpid()})
+
+    sessions = {}
+    identity = _Identity()
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        op = msg[0]
+        if op == "stop":
+            break
+        try:
+            if op == "open":
+                _, sid, tracker, options = msg
+                sessions[sid] = SESSION_TYPES[tracker](options, detector)
+                conn.send({"session": sid})
+            elif op == "frame":
+                _, sid, gray = msg
+                conn.send(sessions[sid].step(gray, identity))
+            elif op == "close":
+                sessions.pop(msg[1], None)
+                conn.send({"closed": msg[1]})
+            elif op == "job":
+                _run_job(conn, msg[1], detector)
+            else:
+                conn.send({"error": f"unknown op {op!r}"})
+        except Exception as e:
+            conn.send({"error": f"{type(e).__name__}: {e}"})
+
+
+def _run_job(conn, job, detector):
+    session = SESSION_TYPES[job["tracker"]](job.get("options", {}), detector)
+    src = VideoSource(job["video"], gray_only=True)
+    if not src.isOpened():
+        conn.send({"error": f"Could not open video: {job['video']}"})
+        return
+    frame_idx = 0
+    try:
+        while True:
+            ret, _, gray = src.read()
+            if not ret:
+                break
+            res = session.step(gray, src)
+            res["frame"] = frame_idx
+            res["t"] = src.frame_time(frame_idx)
+            conn.send(res)
+            frame_idx += 1
+    finally:
+        src.release()
+    conn.send({"done": True, "frames": frame_idx})
+
+
+# ----------------------------------------------------------------------
+# server
+# ----------------------------------------------------------------------
+
+class _WorkerDied(TrackingServiceError):
+    """The worker process exited (crash, OOM kill, ...) during a request."""
+
+
+class _Worker:
+    def __init__(self, ctx):
+        self.ctx = ctx
+        self.lock = threading.Lock()
+        self.sessions = 0
+        self._spawn()
+
+    def _spawn(self):
+        self.conn, child = self.ctx.Pipe()
+        self.proc = self.ctx.Process(target=_worker_main, args=(child,), daemon=True)
+        self.proc.start()
+        child.close()
+
+    def wait_ready(self):
+        self.conn.recv()
+
+    def restart(self):
+        """Replace a dead worker process with a fresh warm one (hold self.lock)."""
+        self.conn.close()
+        if self.proc.is_alive():
+            self.proc.kill()
+        self.proc.join()
+        self._spawn()
+        self.wait_ready()
+
+    def call(self, msg):
+        with self.lock:
+            try:
+                self.conn.send(msg)
+                return self.conn.recv()
+            except (EOFError, OSError):
+                self.restart()
+                raise _WorkerDied("worker process died; it has been restarted")
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        service = self.server.service
+        owned = set()
+        try:
+            while True:
+                header, payload = recv_msg(self.rfile)
+                if header is None:
+                    break
+                try:
+                    service.dispatch(self.request, header, payload, owned)
+                except TrackingServiceError as e:
+                    send_msg(self.request, {"error": str(e)})
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            for sid in owned:
+                service.close_session(sid)
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class TrackingService:
+    """
+    Owns the warm worker pool and the socket server.
+
+    Jobs and sessions get separate workers (job_workers of them run jobs),
+    so a long job never holds up the frames of an interactive session.
+    With a single worker, both share it.
+    """
+
+    def __init__(self, address=DEFAULT_SOCKET, workers=None, job_workers=None):
+        self.address = parse_address(address)
+        self.n_workers = workers or os.cpu_count() or 2
+        if job_workers is None:
+            job_workers = max(1, self.n_workers // 2)
+        self.n_job_workers = min(max(1, job_workers), self.n_workers)
+        self.workers = []
+        self.job_workers = []
+        self.session_workers = []
+        self._idle_job_workers = queue.Queue()
+        self.sessions = {}       # session id -> _Worker
+        self._lock = threading.Lock()
+        self.server = None
+
+    def start(self):
+        ctx = mp.get_context("spawn")
+        self.workers = [_Worker(ctx) for _ in range(self.n_workers)]
+        for w in self.workers:
+            w.wait_ready()
+        if self.n_workers == 1:
+            self.job_workers = self.session_workers = self.workers
+        else:
+            self.job_workers = self.workers[:self.n_job_workers]
+            self.session_workers = self.workers[self.n_job_workers:]
+        for w in self.job_workers:
+            self._idle_job_workers.put(w)
+
+        if isinstance(self.address, tuple):
+            self.server = _TCPServer(self.address, _Handler)
+            self.address = self.server.server_address
+        else:
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+            self.server = _UnixServer(self.address, _Handler)
+        self.server.service = self
+        return self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def serve_in_thread(self):
+        t = threading.Thread(target=self.serve_forever, daemon=True)
+        t.start()
+        return t
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            if isinstance(self.address, str) and os.path.exists(self.address):
+                os.unlink(self.address)
+        for w in self.workers:
+            with w.lock:
+                try:
+                    w.conn.send(("stop",))
+                except OSError:
+                    pass
+            w.proc.join(timeout=5)
+
+    # --- request handling ---
+
+    def _least_loaded(self):
+        return min(self.session_workers, key=lambda w: w.sessions)
+
+    def _call(self, w, msg):
+        try:
+            return w.call(msg)
+        except _WorkerDied:
+            self._forget_sessions(w)
+            raise
+
+    def _forget_sessions(self, w):
+        """Drop the sessions of a worker that died (their state is gone)."""
+        with self._lock:
+            for sid in [sid for sid, owner in self.sessions.items() if owner is w]:
+                del self.sessions[sid]
+            w.sessions = 0
+
+    def close_session(self, sid):
+        with self._lock:
+            w = self.sessions.pop(sid, None)
+            if w is not None:
+                w.sessions -= 1
+        if w is not None:
+            try:
+                self._call(w, ("close", sid))
+            except _WorkerDied:
+                pass
+
+    def dispatch(self, sock, header, payload, owned):
+        op = header.get("op")
+        if op == "ping":
+            send_msg(sock, {"ok": True, "workers": len(self.workers),
+                            "job_workers": len(self.job_workers)})
+
+        elif op == "open":
+            tracker = header.get("tracker")
+            if tracker not in SESSION_TYPES:
+                raise TrackingServiceError(f"unknown tracker {tracker!r}")
+            sid = uuid.uuid4().hex
+            with self._lock:
+                w = self._least_loaded()
+                w.sessions += 1
+                self.sessions[sid] = w
+            reply = self._call(w, ("open", sid, tracker, header.get("options", {})))
+            if "error" in reply:
+                self.close_session(sid)
+            else:
+                owned.add(sid)
+            send_msg(sock, reply)
+
+        elif op == "frame":
+            w = self.sessions.get(header.get("session"))
+            if w is None or header["session"] not in owned:
+                raise TrackingServiceError("unknown session")
+            if payload is None or payload.ndim != 2:
+                raise TrackingServiceError("frame must be a 2-D uint8 gray image")
+            send_msg(sock, self._call(w, ("frame", header["session"], payload)))
+
+        elif op == "close":
+            sid = header.get("session")
+            if sid in owned:
+                owned.discard(sid)
+                self.close_session(sid)
+            send_msg(sock, {"closed": sid})
+
+        elif op == "job":
+            if header.get("tracker") not in SESSION_TYPES:
+                raise TrackingServiceError(f"unknown tracker {header.get('tracker')!r}")
+            job = {k: header.get(k) for k in ("video", "tracker", "options")}
+            job["options"] = job["options"] or {}
+            # wait for a free job worker; one job per worker at a time
+            w = self._idle_job_workers.get()
+            client_ok = True
+            died = False
+            try:
+                with w.lock:
+                    if not w.proc.is_alive():
+                        # died while idle: start a fresh one for this job
+                        w.restart()
+                        self._forget_sessions(w)
+                    try:
+                        w.conn.send(("job", job))
+                        while True:
+                            res = w.conn.recv()
+                            if client_ok:
+                                try:
+                                    send_msg(sock, res)
+                                except OSError:
+                                    # keep draining so the worker pipe stays in sync
+                                    client_ok = False
+                            if "done" in res or "error" in res:
+                                break
+                    except (EOFError, OSError):
+                        w.restart()
+                        died = True
+            finally:
+                self._idle_job_workers.put(w)
+            if died:
+                # with a single shared worker, its sessions are gone too
+                self._forget_sessions(w)
+                raise _WorkerDied("worker process died during the job; "
+                                  "it has been restarted")
+            if not client_ok:
+                raise BrokenPipeError("client went away during job")
+
+        else:
+            raise TrackingServiceError(f"unknown op {op!r}")
+
+
+# ----------------------------------------------------------------------
+# client
+# ----------------------------------------------------------------------
+
+class TrackingSession:
+    def __init__(self, client, sid):
+        self.client = client
+        self.id = sid
+
+    def track(self, frame):
+        """Submit one frame (gray, or BGR which is converted) and get its result."""
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return self.client._request({"op": "frame", "session": self.id}, frame)
+
+    def close(self):
+        self.client._request({"op": "close", "session": self.id})
+
+
+class TrackingClient:
+    """Blocking client; use one client per thread."""
+
+    def __init__(self, address=DEFAULT_SOCKET, timeout=None):
+        address = parse_address(address)
+        family = socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(address)
+        self.rfile = self.sock.makefile("rb")
+
+    def _recv(self):
+        header, _ = recv_msg(self.rfile)
+        if header is None:
+            raise TrackingServiceError("connection closed by service")
+        if "error" in header:
+            raise TrackingServiceError(header["error"])
+        return header
+
+    def _request(self, header, payload=None):
+        send_msg(self.sock, header, payload)
+        return self._recv()
+
+    def ping(self):
+        return self._request({"op": "ping"})
+
+    def open_session(self, tracker, **options):
+        reply = self._request({"op": "open", "tracker": tracker, "options": options})
+        return TrackingSession(self, reply["session"])
+
+    def run_job(self, video, tracker, **options):
+        """Yield per-frame result dicts for a whole video."""
+        send_msg(self.sock, {"op": "job", "video": os.path.abspath(video),
+                             "tracker": tracker, "options": options})
+        finished = False
+        try:
+            while True:
+                res = self._recv()
+                if res.get("done"):
+                    finished = True
+                    return
+                yield res
+        except TrackingServiceError:
+            finished = True
+            raise
+        finally:
+            # stopped early: drain the rest of the stream to stay in sync
+            while not finished:
+                header, _ = recv_msg(self.rfile)
+                finished = header is None or "done" in header or "error" in header
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ----------------------------------------------------------------------
+# CLI
+# ----------------------------------------------------------------------
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local tracking service")
+    parser.add_argument("--address", default=DEFAULT_SOCKET,
+                        help="Unix socket path or host:port (default: %(default)s)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    serve = sub.add_parser("serve", help="Run the daemon")
+    serve.add_argument("--workers", type=int, default=None,
+                       help="Worker processes (default: CPU count)")
+    serve.add_argument("--job-workers", type=int, default=None,
+                       help="Workers reserved for jobs; the rest serve sessions "
+                            "(default: half)")
+
+    job = sub.add_parser("job", help="Run one job against a running daemon")
+    job.add_argument("--video", required=True)
+    job.add_argument("--tracker", choices=TRACKERS, required=True)
+    job.add_argument("--roi", type=int, nargs=4, default=None,
+                     metavar=("X", "Y", "W", "H"), help="ROI for klt")
+    job.add_argument("--masks", default=None, help="Mask NPZ for sam2")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.cmd == "serve":
+        service = TrackingService(args.address, args.workers, args.job_workers).start()
+        print(f"[INFO] Tracking service on {service.address} "
+              f"with {len(service.workers)} warm workers "
+              f"({len(service.job_workers)} for jobs). Ctrl+C to stop.")
+        try:
+            service.serve_forever()
+        except KeyboardInterrupt:
+            print("[INFO] Shutting down.")
+        finally:
+            service.shutdown()
+        return
+
+    options = {}
+    if args.roi:
+        options["roi"] = args.roi
+    if args.masks:
+        options["masks"] = os.path.abspath(args.masks)
+    with TrackingClient(args.address) as client:
+        for res in client.run_job(args.video, args.tracker, **options):
+            print(json.dumps(res))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+tracking_service_harness.py – Local end-to-end check of the tracking service.
+
+- Renders a synthetic clip: ArUco marker (id 3) sliding over a textured
+  background.
+- Starts a TrackingService on a temporary Unix socket.
+- Runs aruco/klt jobs and incremental sessions through TrackingClient and
+  checks the results against the known marker motion.
+- Checks that session frames stay fast while a job runs, and that a
+  killed worker is reported and replaced.
+- Compares warm-session latency with a cold interpreter start.
+
+Usage:
+    python src/tracking_service_harness.py [--workers 2] [--keep]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from tracking_service import TrackingClient, TrackingService, TrackingServiceError
+
+
+MARKER_ID = 3
+MARKER_SIZE = 120
+STEP_PX = 3
+START = (80, 180)
+
+
+def make_test_video(path, n_frames=60, size=(640, 480)):
+    """Write the synthetic clip; returns the true marker boxes per frame."""
+    W, H = size
+    rng = np.random.default_rng(0)
+    background = cv2.GaussianBlur(
+        rng.integers(0, 255, (H, W), dtype=np.uint8), (0, 0), 3
+    )
+    aruco_dict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
+    marker = cv2.aruco.generateImageMarker(aruco_dict, MARKER_ID, MARKER_SIZE)
+    marker = cv2.copyMakeBorder(marker, 20, 20, 20, 20, cv2.BORDER_CONSTANT, value=255)
+    m = marker.shape[0]
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), 30, (W, H))
+    boxes = []
+    # slide right and back (triangle wave) so long clips stay inside the frame
+    span = max(1, W - m - 2 * START[0])
+    for i in range(n_frames):
+        d = (STEP_PX * i) % (2 * span)
+        x, y = START[0] + (d if d < span else 2 * span - d), START[1]
+        frame = background.copy()
+        frame[y:y + m, x:x + m] = marker
+        writer.write(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+        boxes.append((x + 20, y + 20, x + 20 + MARKER_SIZE, y + 20 + MARKER_SIZE))
+    writer.release()
+    return boxes
+
+
+def check(name, ok, detail=""):
+    print(f"[{'PASS' if ok else 'FAIL'}] {name}" + (f" – {detail}" if detail else ""))
+    return ok
+
+
+def center(box):
+    return 0.5 * (box[0] + box[2]), 0.5 * (box[1] + box[3])
+
+
+def run(workers, keep):
+    tmp = tempfile.mkdtemp(prefix="tracking_service_")
+    video = os.path.join(tmp, "marker.mp4")
+    boxes = make_test_video(video)
+    sock_path = os.path.join(tmp, "service.sock")
+
+    t = time.perf_counter()
+    service = TrackingService(sock_path, workers).start()
+    service.serve_in_thread()
+    print(f"[INFO] {workers} workers warm in {time.perf_counter() - t:.2f}s")
+
+    results = []
+    try:
+        with TrackingClient(sock_path, timeout=30) as client:
+            results.append(check("ping", client.ping().get("workers") == workers))
+
+            # --- aruco job ---
+            frames = list(client.run_job(video, "aruco"))
+            hits = [f for f in frames if any(m["id"] == MARKER_ID for m in f["markers"])]
+            err = max((abs(f["markers"][0]["center"][0] - center(boxes[f["frame"]])[0])
+                       for f in hits), default=float("inf"))
+            results.append(check("aruco job", len(frames) == len(boxes)
+                                 and len(hits) >= 0.9 * len(boxes) and err < 3,
+                                 f"{len(hits)}/{len(frames)} frames, max x error {err:.2f}px"))
+
+            # --- klt job ---
+            x1, y1, x2, y2 = boxes[0]
+            frames = list(client.run_job(video, "klt", roi=[x1, y1, x2 - x1, y2 - y1]))
+            cx, _ = center(frames[-1]["box"])
+            drift = abs(cx - center(boxes[len(frames) - 1])[0])
+            results.append(check("klt job", len(frames) == len(boxes) and drift < 10,
+                                 f"final center drift {drift:.2f}px"))
+
+            # --- incremental sessions ---
+            cap = cv2.VideoCapture(video)
+            aruco = client.open_session("aruco")
+            klt = client.open_session("klt", roi=[x1, y1, x2 - x1, y2 - y1])
+            latencies = []
+            last = None
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                t = time.perf_counter()
+                aruco.track(gray)
+                latencies.append(time.perf_counter() - t)
+                last = klt.track(gray)
+            cap.release()
+            aruco.close()
+            klt.close()
+            drift = abs(center(last["box"])[0] - center(boxes[-1])[0])
+            results.append(check("klt session keeps state", drift < 10,
+                                 f"final center drift {drift:.2f}px"))
+
+            # --- a running job does not hold up session frames ---
+            gray = cv2.cvtColor(cv2.VideoCapture(video).read()[1], cv2.COLOR_BGR2GRAY)
+            session = client.open_session("aruco")
+
+            def long_job():
+                with TrackingClient(sock_path, timeout=60) as job_client:
+                    for _ in range(3):
+                        list(job_client.run_job(video, "klt", roi=[x1, y1, x2 - x1, y2 - y1]))
+
+            job = threading.Thread(target=long_job)
+            job.start()
+            time.sleep(0.2)
+            during = []
+            while job.is_alive() and len(during) < 50:
+                t = time.perf_counter()
+                session.track(gray)
+                during.append(time.perf_counter() - t)
+            job.join()
+            session.close()
+            warm = float(np.median(latencies))
+            busy = float(np.median(during)) if during else float("nan")
+            results.append(check("sessions unaffected by jobs",
+                                 during and busy < max(3 * warm, warm + 0.005),
+                                 f"median {busy * 1000:.2f} ms during job, "
+                                 f"{warm * 1000:.2f} ms idle"))
+
+            # --- dead worker is restarted ---
+            session = client.open_session("aruco")
+            service.sessions[session.id].proc.kill()
+            try:
+                session.track(gray)
+                reported = False
+            except TrackingServiceError:
+                reported = True
+            session = client.open_session("aruco")
+            recovered = "markers" in session.track(gray)
+            session.close()
+            results.append(check("dead worker reported and restarted",
+                                 reported and recovered))
+
+            # --- error path ---
+            try:
+                client.open_session("klt")
+                results.append(check("bad options rejected", False))
+            except Exception as e:
+                results.append(check("bad options rejected", True, str(e)))
+    finally:
+        service.shutdown()
+
+    # --- warm vs cold ---
+    t = time.perf_counter()
+    subprocess.run([sys.executable, "-c",
+                    "import cv2; d = cv2.aruco.ArucoDetector("
+                    "cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50), "
+                    "cv2.aruco.DetectorParameters())"], check=True)
+    cold = time.perf_counter() - t
+    warm = float(np.median(latencies)) if latencies else float("nan")
+    print(f"[INFO] cold interpreter + detector: {cold * 1000:.1f} ms, "
+          f"warm session frame (median): {warm * 1000:.2f} ms")
+
+    if keep:
+        print(f"[INFO] Files kept in {tmp}")
+    else:
+        for name in os.listdir(tmp):
+            os.unlink(os.path.join(tmp, name))
+        os.rmdir(tmp)
+    return all(results)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Tracking service test harness")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--keep", action="store_true", help="Keep temporary files")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    ok = run(args.workers, args.keep)
+    print("[INFO] All checks passed." if ok else "[ERROR] Some checks failed.")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+trajectory_store.py – Compact columnar storage for tracker outputs.
+
+One run = one .traj file:
+
+    header   b"TRAJ" | version u32 | meta_len u32 | meta JSON | pad to 8
+    chunk*   b"CHNK" | rows u32 | column 0 | column 1 | ...   (each padded to 8)
+    footer   chunk index (offset, rows, frame/id min/max per chunk)
+    trailer  footer offset u64 | b"TRAJEND1"
+
+Columns (one row per tracked object per frame):
+    frame       int64
+    timestamp   float64    seconds (video time, or clock time for cameras)
+    obj_id      int32      marker id for ArUco, 0 for single-object trackers
+    box         float32[4] x1, y1, x2, y2 in upright frame coordinates
+    center      float32[2]
+    pose        float32[6] rvec + tvec, NaN when unknown
+    confidence  float32
+
+Chunks are only ever appended. A range query touches only the chunks whose
+footer entry (frame and id bounds) overlaps it, and the column data is read
+straight from a memory map. A file without footer (crashed writer) is
+recovered by scanning the chunk headers.
+
+Usage:
+    python src/trajectory_store.py run.traj --frames 100 200 --id 3
+"""
+
+import argparse
+import json
+import struct
+
+import numpy as np
+
+
+MAGIC = b"TRAJ"
+CHUNK_MAGIC = b"CHNK"
+TRAILER_MAGIC = b"TRAJEND1"
+VERSION = 1
+
+COLUMNS = [
+    ("frame", np.dtype("<i8"), ()),
+    ("timestamp", np.dtype("<f8"), ()),
+    ("obj_id", np.dtype("<i4"), ()),
+    ("box", np.dtype("<f4"), (4,)),
+    ("center", np.dtype("<f4"), (2,)),
+    ("pose", np.dtype("<f4"), (6,)),
+    ("confidence", np.dtype("<f4"), ()),
+]
+
+INDEX_DTYPE = np.dtype([
+    ("offset", "<u8"),
+    ("rows", "<u4"),
+    ("frame_min", "<i8"),
+    ("frame_max", "<i8"),
+    ("id_min", "<i4"),
+    ("id_max", "<i4"),
+])
+
+_CHUNK_HEAD = struct.Struct("<4sI")
+_TRAILER = struct.Struct("<Q8s")
+
+
+def _pad8(n):
+    return (-n) % 8
+
+
+def _chunk_layout(rows):
+    """Byte offsets of each column relative to the chunk start, and total size."""
+    offsets = {}
+    pos = _CHUNK_HEAD.size
+    for name, dtype, shape in COLUMNS:
+        offsets[name] = pos
+        pos += rows * dtype.itemsize * int(np.prod(shape, dtype=np.int64))
+        pos += _pad8(pos)
+    return offsets, pos
+
+
+class TrajectoryWriter:
+    """Buffers rows in preallocated column arrays and appends full chunks."""
+
+    def __init__(self, path, meta=None, chunk_rows=4096):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        self._f = open(path, "wb")
+        self._index = []
+        self._n = 0
+        self._cols = {
+            name: np.empty((chunk_rows,) + shape, dtype=dtype)
+            for name, dtype, shape in COLUMNS
+        }
+
+        meta_bytes = json.dumps(meta or {}).encode("utf-8")
+        head = MAGIC + struct.pack("<II", VERSION, len(meta_bytes)) + meta_bytes
+        self._f.write(head + b"\0" * _pad8(len(head)))
+
+    def append(self, frame, timestamp, obj_id, box, center=None, pose=None,
+               confidence=1.0):
+        i = self._n
+        c = self._cols
+        c["frame"][i] = frame
+        c["timestamp"][i] = timestamp
+        c["obj_id"][i] = obj_id
+        c["box"][i] = box
+        if center is None:
+            c["center"][i, 0] = 0.5 * (c["box"][i, 0] + c["box"][i, 2])
+            c["center"][i, 1] = 0.5 * (c["box"][i, 1] + c["box"][i, 3])
+        else:
+            c["center"][i] = center
+        c["pose"][i] = np.nan if pose is None else np.ravel(pose)
+        c["confidence"][i] = confidence
+        self._n += 1
+        if self._n == self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        """Append buffered rows as one chunk."""
+        n = self._n
+        if n == 0:
+            return
+        offset = self._f.tell()
+        self._f.write(_CHUNK_HEAD.pack(CHUNK_MAGIC, n))
+        pos = _CHUNK_HEAD.size
+        for name, _, _ in COLUMNS:
+            data = self._cols[name][:n].tobytes()
+            pos += len(data)
+            self._f.write(data + b"\0" * _pad8(pos))
+            pos += _pad8(pos)
+
+        frames = self._cols["frame"][:n]
+        ids = self._cols["obj_id"][:n]
+        self._index.append((offset, n, frames.min(), frames.max(),
+                            ids.min(), ids.max()))
+        self._n = 0
+
+    def close(self):
+        if self._f is None:
+            return
+        self.flush()
+        footer_offset = self._f.tell()
+        self._f.write(np.array(self._index, dtype=INDEX_DTYPE).tobytes())
+        self._f.write(_TRAILER.pack(footer_offset, TRAILER_MAGIC))
+        self._f.close()
+        self._f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TrajectoryReader:
+    """Memory-mapped reader answering frame-range / id queries chunk by chunk."""
+
+    def __init__(self, path):
+        self.path = path
+        self._buf = np.memmap(path, dtype=np.uint8, mode="r")
+
+        if bytes(self._buf[:4]) != MAGIC:
+            raise ValueError(f"{path} is not a trajectory file")
+        version, meta_len = struct.unpack("<II", bytes(self._buf[4:12]))
+        if version != VERSION:
+            raise ValueError(f"Unsupported trajectory version {version}")
+        self.meta = json.loads(bytes(self._buf[12:12 + meta_len]).decode("utf-8"))
+        self._data_start = 12 + meta_len + _pad8(12 + meta_len)
+
+        self.index = self._read_footer()
+        if self.index is None:
+            self.index = self._scan_chunks()
+
+    def _read_footer(self):
+        size = len(self._buf)
+        if size < self._data_start + _TRAILER.size:
+            return None
+        footer_offset, magic = _TRAILER.unpack(bytes(self._buf[size - _TRAILER.size:]))
+        if magic != TRAILER_MAGIC:
+            return None
+        raw = self._buf[footer_offset:size - _TRAILER.size]
+        return np.frombuffer(raw.tobytes(), dtype=INDEX_DTYPE)
+
+    def _scan_chunks(self):
+        """Rebuild the chunk index of a file whose writer never closed."""
+        entries = []
+        pos = self._data_start
+        size = len(self._buf)
+        while pos + _CHUNK_HEAD.size <= size:
+            magic, rows = _CHUNK_HEAD.unpack(bytes(self._buf[pos:pos + _CHUNK_HEAD.size]))
+            _, chunk_size = _chunk_layout(rows)
+            if magic != CHUNK_MAGIC or pos + chunk_size > size:
+                break
+            frames = self._column(pos, rows, "frame")
+            ids = self._column(pos, rows, "obj_id")
+            entries.append((pos, rows, frames.min(), frames.max(),
+                            ids.min(), ids.max()))
+            pos += chunk_size
+        return np.array(entries, dtype=INDEX_DTYPE)
+
+    def _column(self, offset, rows, name):
+        offsets, _ = _chunk_layout(rows)
+        for col, dtype, shape in COLUMNS:
+            if col == name:
+                start = offset + offsets[name]
+                count = rows * int(np.prod(shape, dtype=np.int64))
+                arr = self._buf[start:start + count * dtype.itemsize].view(dtype)
+                return arr.reshape((rows,) + shape)
+        raise KeyError(name)
+
+    def __len__(self):
+        return int(self.index["rows"].sum())
+
+    @property
+    def frame_range(self):
+        if len(self.index) == 0:
+            return None
+        return int(self.index["frame_min"].min()), int(self.index["frame_max"].max())
+
+    def query(self, frame_start=None, frame_stop=None, obj_id=None, columns=None):
+        """
+        Rows with frame_start <= frame < frame_stop (and obj_id if given).
+
+        Returns a dict of column name -> array holding only matching rows.
+        """
+        names = columns or [name for name, _, _ in COLUMNS]
+        lo = np.iinfo(np.int64).min if frame_start is None else frame_start
+        hi = np.iinfo(np.int64).max if frame_stop is None else frame_stop
+
+        parts = {name: [] for name in names}
+        for entry in self.index:
+            if entry["frame_max"] < lo or entry["frame_min"] >= hi:
+                continue
+            if obj_id is not None and not (entry["id_min"] <= obj_id <= entry["id_max"]):
+                continue
+            offset, rows = int(entry["offset"]), int(entry["rows"])
+
+            frames = self._column(offset, rows, "frame")
+            keep = (frames >= lo) & (frames < hi)
+            if obj_id is not None:
+                keep &= self._column(offset, rows, "obj_id") == obj_id
+            sel = np.flatnonzero(keep)
+            if len(sel) == 0:
+                continue
+            for name in names:
+                parts[name].append(np.array(self._column(offset, rows, name)[sel]))
+
+        out = {}
+        for name, dtype, shape in COLUMNS:
+            if name in parts:
+                out[name] = (np.concatenate(parts[name]) if parts[name]
+                             else np.empty((0,) + shape, dtype=dtype))
+        return out
+
+    def ids(self):
+        return np.unique(np.concatenate(
+            [self._column(int(e["offset"]), int(e["rows"]), "obj_id") for e in self.index]
+        )) if len(self.index) else np.empty(0, dtype=np.int32)
+
+    def close(self):
+        self._buf = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Query a trajectory file")
+    parser.add_argument("path", help="Path to .traj file")
+    parser.add_argument("--frames", type=int, nargs=2, default=None,
+                        metavar=("START", "STOP"), help="Frame range [START, STOP)")
+    parser.add_argument("--id", type=int, default=None, help="Object / marker id")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with TrajectoryReader(args.path) as reader:
+        print(f"[INFO] meta: {reader.meta}")
+        print(f"[INFO] rows: {len(reader)} in {len(reader.index)} chunks, "
+              f"frames: {reader.frame_range}")
+        start, stop = args.frames if args.frames else (None, None)
+        rows = reader.query(start, stop, obj_id=args.id)
+        for i in range(len(rows["frame"])):
+            x1, y1, x2, y2 = rows["box"][i]
+            print(f"{rows['frame'][i]:8d} {rows['timestamp'][i]:10.4f} "
+                  f"id={rows['obj_id'][i]:<4d} box=({x1:.1f},{y1:.1f},{x2:.1f},{y2:.1f}) "
+                  f"conf={rows['confidence'][i]:.2f}")
+
+
+if __name__ == "__main__":
+    main()
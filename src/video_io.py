@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+video_io.py – Shared video frontend for all trackers.
+
+The trackers used to call ensure_upright() on every frame, which for
+portrait footage meant a full-frame cv2.rotate allocation followed by a
+full-frame cvtColor on the rotated copy.
+
+VideoSource instead:
+- Decides the orientation ONCE, from the first decoded frame (the decoders
+  already apply the container's rotation metadata; portrait frames are then
+  turned to landscape exactly like ensure_upright did).
+- Keeps frames in their native orientation. Tracking runs on native
+  coordinates, and only points/boxes and the displayed frame are rotated.
+- Decodes into reusable buffers (cap.read(image=...), cvtColor(dst=...)).
+- For gray-only consumers reading a file, decodes straight to luma through
+  an FFmpeg rawvideo pipe (-pix_fmt gray), so no BGR frame exists at all.
+"""
+
+import shutil
+import subprocess
+import time
+
+import cv2
+import numpy as np
+
+
+def detect_rotation(frame_shape):
+    """Return the cv2 rotate code that makes a frame landscape, or None."""
+    h, w = frame_shape[:2]
+    if h > w:
+        return cv2.ROTATE_90_CLOCKWISE
+    return None
+
+
+class _FFmpegGrayReader:
+    """Reads 8-bit luma frames from an `ffmpeg -pix_fmt gray` rawvideo pipe."""
+
+    def __init__(self, path, width, height, start_time=0.0, scaled=False, step=1):
+        cmd = ["ffmpeg", "-v", "error", "-nostdin"]
+        if start_time > 0:
+            cmd += ["-ss", f"{start_time:.6f}"]
+        cmd += ["-i", path, "-an"]
+        filters = []
+        if step > 1:
+            # dropped before scaling / conversion; -vsync 0 keeps ffmpeg
+            # from duplicating frames to restore the input frame rate
+            filters.append(f"select=not(mod(n\\,{step}))")
+            cmd += ["-vsync", "0"]
+        if scaled:
+            filters.append(f"scale={width}:{height}:flags=area")
+        if filters:
+            cmd += ["-vf", ",".join(filters)]
+        cmd += ["-f", "rawvideo", "-pix_fmt", "gray", "-"]
+        self.frame_bytes = width * height
+        self.proc = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, bufsize=self.frame_bytes
+        )
+
+    def read_into(self, buf):
+        view = memoryview(buf).cast("B")
+        n = 0
+        while n < self.frame_bytes:
+            k = self.proc.stdout.readinto(view[n:])
+            if not k:
+                return False
+            n += k
+        return True
+
+    def release(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.stdout.close()
+        self.proc.wait()
+
+
+class VideoSource:
+    """
+    Video file or camera with orientation fixed at open time.
+
+    read() returns (ok, frame, gray) in NATIVE orientation. Both arrays are
+    reused between calls, so copy them if they must outlive the next read(),
+    or pass gray_out= to decode into a buffer of your own (e.g. to ping-pong
+    between two gray buffers without copying).
+    With gray_only=True, frame is always None; with need_gray=False (display
+    only consumers such as the SAM2 playback), gray is always None.
+    scale < 1 shrinks the gray output (e.g. for a fast preview pass); the
+    coordinate helpers always refer to full resolution. step > 1 returns
+    only every step-th frame (the others are skipped without conversion).
+
+    Use upright() for display and the to_upright_* / to_native_* helpers to
+    move coordinates between the native and the upright (landscape) frame.
+    """
+
+    def __init__(self, source, gray_only=False, use_ffmpeg=True, start_frame=0,
+                 need_gray=True, scale=1.0, step=1):
+        self.source = source
+        self.gray_only = gray_only
+        self.need_gray = need_gray or gray_only
+        self.step = max(1, int(step))
+        self.cap = cv2.VideoCapture(source)
+        self._ffmpeg = None
+        self._pending = False
+        self.first_frame = None
+
+        if not self.cap.isOpened():
+            return
+
+        self._t0 = time.monotonic()
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 0.0
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+
+        if start_frame > 0:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+
+        ret, frame = self.cap.read()
+        if not ret:
+            self.cap.release()
+            return
+
+        # Orientation is decided once, here, and never per frame.
+        self.first_frame = frame
+        self.rotation = detect_rotation(frame.shape)
+        self.native_h, self.native_w = frame.shape[:2]
+        if self.rotation is None:
+            self.width, self.height = self.native_w, self.native_h
+        else:
+            self.width, self.height = self.native_h, self.native_w
+
+        self._frame = None
+        self._gray_full = None
+        gray_w, gray_h = self.native_w, self.native_h
+        if scale != 1.0:
+            gray_w = max(2, int(round(self.native_w * scale / 2)) * 2)
+            gray_h = max(2, int(round(self.native_h * scale / 2)) * 2)
+            self._gray_full = np.empty((self.native_h, self.native_w), dtype=np.uint8)
+        self._gray = np.empty((gray_h, gray_w), dtype=np.uint8)
+        self.gray_size = (gray_w, gray_h)
+        self._upright = None
+        if self.rotation is not None:
+            self._upright = np.empty((self.height, self.width, 3), dtype=np.uint8)
+
+        is_file = isinstance(source, str)
+        if gray_only and use_ffmpeg and is_file and shutil.which("ffmpeg"):
+            self.cap.release()
+            start_time = start_frame / self.fps if self.fps > 0 else 0.0
+            self._ffmpeg = _FFmpegGrayReader(
+                source, gray_w, gray_h, start_time, scaled=scale != 1.0,
+                step=self.step
+            )
+        else:
+            # The first frame is handed out by the first read().
+            self._pending = True
+
+    def isOpened(self):
+        return self.first_frame is not None
+
+    def new_gray_buffer(self):
+        """An empty buffer with the shape read() needs for gray_out."""
+        return np.empty_like(self._gray)
+
+    def read(self, gray_out=None):
+        gray = self._gray if gray_out is None else gray_out
+        if self._ffmpeg is not None:
+            if not self._ffmpeg.read_into(gray):
+                return False, None, None
+            return True, None, gray
+
+        if self._pending:
+            # Decode into a private buffer so first_frame stays intact.
+            self._pending = False
+            self._frame = frame = self.first_frame.copy()
+        else:
+            for _ in range(self.step - 1):
+                if not self.cap.grab():
+                    return False, None, None
+            ret, frame = self.cap.read(image=self._frame)
+            if not ret:
+                return False, None, None
+            self._frame = frame
+
+        if not self.need_gray:
+            return True, frame, None
+        if self._gray_full is None:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray)
+        else:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._gray_full)
+            cv2.resize(self._gray_full, gray.shape[::-1], dst=gray,
+                       interpolation=cv2.INTER_AREA)
+        return True, (None if self.gray_only else frame), gray
+
+    def frame_time(self, frame_idx):
+        """Seconds since start: video time for files, wall clock for cameras."""
+        if isinstance(self.source, str) and self.fps > 0:
+            return frame_idx / self.fps
+        return time.monotonic() - self._t0
+
+    def upright(self, frame):
+        """Return frame in upright orientation (a reused buffer if rotated)."""
+        if self.rotation is None:
+            return frame
+        if frame.ndim == 2:
+            return cv2.rotate(frame, self.rotation)
+        cv2.rotate(frame, self.rotation, dst=self._upright)
+        return self._upright
+
+    # --- coordinate mapping (90° clockwise: native (x, y) -> (Hn-1-y, x)) ---
+
+    def to_upright_points(self, pts):
+        if self.rotation is None:
+            return pts
+        pts = np.asarray(pts, dtype=np.float32)
+        out = np.empty_like(pts)
+        out[..., 0] = (self.native_h - 1) - pts[..., 1]
+        out[..., 1] = pts[..., 0]
+        return out
+
+    def to_native_points(self, pts):
+        if self.rotation is None:
+            return pts
+        pts = np.asarray(pts, dtype=np.float32)
+        out = np.empty_like(pts)
+        out[..., 0] = pts[..., 1]
+        out[..., 1] = (self.native_h - 1) - pts[..., 0]
+        return out
+
+    def to_upright_box(self, box):
+        """Map an (x1, y1, x2, y2) box with exclusive x2/y2 to upright."""
+        if self.rotation is None:
+            return box
+        x1, y1, x2, y2 = box
+        return np.array(
+            [self.native_h - y2, x1, self.native_h - y1, x2], dtype=np.float32
+        )
+
+    def to_native_box(self, box):
+        if self.rotation is None:
+            return box
+        x1, y1, x2, y2 = box
+        return np.array(
+            [y1, self.native_h - x2, y2, self.native_h - x1], dtype=np.float32
+        )
+
+    def release(self):
+        if self._ffmpeg is not None:
+            self._ffmpeg.release()
+            self._ffmpeg = None
+        self.cap.release()